@@ -0,0 +1,474 @@
+#!/usr/bin/python3
+
+# Benchmarks for the nemo-media-columns hot path.
+#
+#   media_benchmark.py run [--output results.json] [--compare baseline.json]
+#   media_benchmark.py compare baseline.json results.json
+#
+# A synthetic corpus (see media_corpus.py) is generated once and reused.
+# Each file is then timed in two stages:
+#
+#   extract    media_extractors.get_media_info(), in this process - the
+#              parsers on their own.
+#   extension  ColumnExtension.get_media_info() followed by update_cb() with
+#              a stand-in for Nemo.FileInfo - what Nemo waits for, extractor
+#              process round trip and column formatting included.  Needs the
+#              Nemo typelib and the extension's GSettings schema, and is left
+#              out without them.
+#
+# Every file's values are checked against the corpus on the first pass; any
+# that come out wrong, or fail outright, are counted as mismatches, and fail
+# the run.
+#
+# For every format the latency percentiles, bytes read, peak Python
+# allocations and throughput go into a JSON file.  Comparing two of them
+# lists the formats that got slower, and exits with status 1 if any did by
+# more than the threshold.
+#
+# Files are read from the page cache after the first pass, so these are warm
+# cache numbers - dropping the caches needs root.
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import importlib.util
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.dirname(BENCHMARK_DIR)
+
+sys.path.insert(0, SOURCE_DIR)
+
+# Keep the extension from opening the user's own metadata cache - GLib reads
+# this on first use.
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="nemo-media-columns-benchmark-")
+
+import media_corpus
+import media_extractors
+
+RESULTS_VERSION = 1
+
+DEFAULT_CORPUS = os.path.join(tempfile.gettempdir(), "nemo-media-columns-corpus")
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 10.0
+
+# Changes smaller than this are noise, whatever the percentage (ms).
+NOISE_FLOOR = 0.05
+
+PERCENTILES = (50, 95, 99)
+
+def percentile(values, p):
+    # Nearest rank, values sorted.
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+def get_bytes_read():
+    # Everything this process has read, or None if we can't tell.
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+class FormatResult():
+    def __init__(self):
+        self.latencies = []
+        self.bytes_read = []
+        self.allocations = []
+        self.errors = 0
+        self.mismatches = 0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        total = sum(latencies)
+        result = {"files": len(self.allocations) or len(latencies), "samples": len(latencies),
+                  "errors": self.errors, "mismatches": self.mismatches}
+
+        for p in PERCENTILES:
+            value = percentile(latencies, p)
+            result["p%d_ms" % p] = None if value is None else round(value * 1000, 4)
+
+        result["mean_ms"] = round(total / len(latencies) * 1000, 4) if latencies else None
+        result["bytes_read_mean"] = (round(sum(self.bytes_read) / len(self.bytes_read))
+                                     if self.bytes_read else None)
+        result["alloc_peak_bytes_mean"] = (round(sum(self.allocations) / len(self.allocations))
+                                           if self.allocations else None)
+        result["files_per_s"] = round(len(latencies) / total, 2) if total else None
+
+        return result
+
+class StubFileInfo():
+    # Just what the extension asks a Nemo.FileInfo for.
+    def __init__(self, path, mimetype):
+        self.path = path
+        self.mimetype = mimetype
+        self.uri = "file://" + path
+        self.attributes = {}
+
+    def get_uri(self):
+        return self.uri
+
+    def get_activation_uri(self):
+        return self.uri
+
+    def get_parent_uri(self):
+        return "file://" + os.path.dirname(self.path)
+
+    def get_uri_scheme(self):
+        return "file"
+
+    def get_mime_type(self):
+        return self.mimetype
+
+    def add_string_attribute(self, attribute, value):
+        self.attributes[attribute] = value
+
+    def invalidate_extension_info(self):
+        pass
+
+class NemoStub():
+    # Passes everything on to the real Nemo module, apart from telling Nemo
+    # an update is complete - there's no Nemo waiting for it.
+    def __init__(self, nemo):
+        self.nemo = nemo
+        self.completed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.nemo, name)
+
+    def info_provider_update_complete_invoke(self, closure, provider, handle, result):
+        self.completed += 1
+
+class ExtractStage():
+    name = "extract"
+
+    def prepare(self, args):
+        return True
+
+    def run_file(self, path, mimetype):
+        # Returns the bytes read and the FileExtensionInfo, or raises on
+        # failure.
+        before = get_bytes_read()
+        info = media_extractors.get_media_info(path, mimetype)
+        after = get_bytes_read()
+
+        return None if before is None or after is None else after - before, info
+
+    def close(self):
+        pass
+
+class ExtensionStage():
+    name = "extension"
+
+    def prepare(self, args):
+        try:
+            import gi
+            gi.require_version('Nemo', '3.0')
+            from gi.repository import Gio, Nemo
+        except (ImportError, ValueError) as e:
+            print("media_benchmark: leaving out the extension stage, Nemo isn't available: %s" % e, file=sys.stderr)
+            return False
+
+        # GSettings aborts on a schema that isn't installed.
+        source = Gio.SettingsSchemaSource.get_default()
+
+        if source is None or source.lookup("org.nemo.extensions.nemo-media-columns", True) is None:
+            print("media_benchmark: leaving out the extension stage, its GSettings schema isn't installed",
+                  file=sys.stderr)
+            return False
+
+        spec = importlib.util.spec_from_file_location("nemo_media_columns",
+                                                      os.path.join(SOURCE_DIR, "nemo-media-columns.py"))
+        self.module = importlib.util.module_from_spec(spec)
+
+        try:
+            spec.loader.exec_module(self.module)
+            self.extension = self.module.ColumnExtension()
+        except Exception as e:
+            print("media_benchmark: leaving out the extension stage, the extension didn't load: %s" % e,
+                  file=sys.stderr)
+            return False
+
+        import media_mounts
+        self.media_mounts = media_mounts
+
+        self.module.Nemo = NemoStub(self.module.Nemo)
+        self.extension.timeout = args.timeout
+        self.handle = 0
+
+        return True
+
+    def run_file(self, path, mimetype):
+        extension = self.extension
+        extractor = media_extractors.registry.lookup(mimetype)
+        wanted = frozenset(extractor.attributes)
+        file = StubFileInfo(path, mimetype)
+        # Only used to find out what the extractor read.
+        ticket = self.media_mounts.Ticket(None, 0, self.media_mounts.ROOT.mount_point)
+        self.handle += 1
+
+        info, error = extension.get_media_info(path, mimetype, wanted, None, ticket)
+        extension.update_cb(info, None, self.handle, None, file, file.uri, file.get_parent_uri(),
+                            extension.visible_columns.attributes)
+
+        if info is None:
+            raise RuntimeError(error)
+
+        return ticket.bytes_read, info
+
+    def close(self):
+        self.extension.extractors.resize(1)
+        self.extension.monitors.clear()
+
+STAGES = (ExtractStage, ExtensionStage)
+
+# How far off a length may be - MP3 lengths are estimated from the bitrate.
+LENGTH_TOLERANCE = 0.01
+
+def same_value(value, expected):
+    if isinstance(expected, float) and isinstance(value, (int, float)):
+        return math.isclose(value, expected, rel_tol=LENGTH_TOLERANCE)
+
+    return value == expected
+
+def check_values(stage, f, info):
+    # Returns whether info has the values the corpus expects for f.
+    wrong = ["%s is %r, not %r" % (field, getattr(info, field), value)
+             for field, value in sorted(f.get("expected", {}).items()) if not same_value(getattr(info, field), value)]
+
+    for problem in wrong:
+        print("media_benchmark: %s: %s: %s" % (stage.name, f["path"], problem), file=sys.stderr)
+
+    return not wrong
+
+def run_stage(stage, files, corpus, repeat):
+    results = {}
+
+    # One untimed pass, which loads the parsing libraries and the files
+    # into the page cache, and checks the values.
+    for f in files:
+        result = results.setdefault(f["format"], FormatResult())
+
+        try:
+            bytes_read, info = stage.run_file(os.path.join(corpus, f["path"]), f["mimetype"])
+        except Exception as e:
+            print("media_benchmark: %s: %s: failed: %s" % (stage.name, f["path"], e), file=sys.stderr)
+            result.mismatches += 1
+            continue
+
+        if not check_values(stage, f, info):
+            result.mismatches += 1
+
+    for f in files:
+        path = os.path.join(corpus, f["path"])
+        result = results[f["format"]]
+
+        # Allocations on a pass of their own, tracemalloc slows everything down.
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        start_size = tracemalloc.get_traced_memory()[0]
+
+        try:
+            stage.run_file(path, f["mimetype"])
+        except Exception:
+            pass
+
+        result.allocations.append(tracemalloc.get_traced_memory()[1] - start_size)
+        tracemalloc.stop()
+
+        for i in range(repeat):
+            started = time.perf_counter()
+
+            try:
+                bytes_read, info = stage.run_file(path, f["mimetype"])
+            except Exception:
+                result.errors += 1
+                continue
+
+            result.latencies.append(time.perf_counter() - started)
+
+            if bytes_read is not None:
+                result.bytes_read.append(bytes_read)
+
+    return dict((name, result.summary()) for name, result in sorted(results.items()))
+
+def run(args):
+    print("media_benchmark: generating the corpus in %s" % args.corpus, flush=True)
+    files = media_corpus.generate(args.corpus, args.scale)
+
+    if args.formats:
+        files = [f for f in files if f["format"] in args.formats]
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "corpus": {"version": media_corpus.CORPUS_VERSION, "scale": args.scale, "files": len(files)},
+        "repeat": args.repeat,
+        "stages": {},
+    }
+
+    for stage_class in STAGES:
+        if args.stages and stage_class.name not in args.stages:
+            continue
+
+        stage = stage_class()
+
+        if not stage.prepare(args):
+            continue
+
+        print("media_benchmark: running the %s stage" % stage.name, flush=True)
+
+        try:
+            results["stages"][stage.name] = run_stage(stage, files, args.corpus, args.repeat)
+        finally:
+            stage.close()
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print("media_benchmark: results written to %s" % args.output)
+
+    status = 0
+
+    if args.compare:
+        with open(args.compare) as f:
+            status = compare(json.load(f), results, args.threshold)
+
+    mismatches = sum(r["mismatches"] for formats in results["stages"].values() for r in formats.values())
+    # Formats none of whose files could be timed - there are no numbers to
+    # compare, so this would otherwise pass unnoticed.
+    broken = ["%s/%s" % (stage, name) for stage, formats in sorted(results["stages"].items())
+              for name, r in sorted(formats.items()) if not r["samples"]]
+
+    if broken:
+        print("media_benchmark: every run failed for %s" % ", ".join(broken), file=sys.stderr)
+    if mismatches:
+        print("media_benchmark: %d file(s) came out with the wrong values" % mismatches, file=sys.stderr)
+    if broken or mismatches:
+        return 1
+
+    return status
+
+def print_results(results):
+    for stage, formats in sorted(results["stages"].items()):
+        print("\n%s" % stage)
+        print("  %-8s %6s %6s %6s %10s %10s %10s %12s %12s %10s"
+              % ("format", "files", "errors", "wrong", "p50 ms", "p95 ms", "p99 ms",
+                 "read/file", "alloc/file", "files/s"))
+        for name, r in sorted(formats.items()):
+            print("  %-8s %6d %6d %6d %10s %10s %10s %12s %12s %10s"
+                  % (name, r["files"], r["errors"], r.get("mismatches", 0), r["p50_ms"], r["p95_ms"], r["p99_ms"],
+                     r["bytes_read_mean"], r["alloc_peak_bytes_mean"], r["files_per_s"]))
+
+def compare(baseline, results, threshold):
+    # Prints how each format changed, returns 1 if any got slower by more
+    # than threshold percent.
+    regressions = []
+
+    corpus = (results["corpus"]["version"], results["corpus"]["scale"])
+
+    if (baseline["corpus"]["version"], baseline["corpus"]["scale"]) != corpus:
+        print("media_benchmark: the two runs used different corpora, the numbers may not be comparable")
+
+    for stage, formats in sorted(results["stages"].items()):
+        old_formats = baseline.get("stages", {}).get(stage)
+
+        if old_formats is None:
+            continue
+
+        print("\n%s, compared to the baseline" % stage)
+
+        for name, new in sorted(formats.items()):
+            old = old_formats.get(name)
+
+            if old is None:
+                continue
+
+            changes = []
+
+            for key in ("p50_ms", "p95_ms", "p99_ms", "bytes_read_mean", "alloc_peak_bytes_mean"):
+                if not old.get(key) or new.get(key) is None:
+                    continue
+
+                change = (new[key] - old[key]) * 100.0 / old[key]
+                changes.append("%s %+.1f%%" % (key, change))
+
+                # Only the typical and slow cases - p99 of a few samples is
+                # mostly noise.
+                if (key in ("p50_ms", "p95_ms") and change > threshold and
+                        new[key] - old[key] > NOISE_FLOOR):
+                    regressions.append("%s/%s %s: %.3f -> %.3f ms" % (stage, name, key, old[key], new[key]))
+
+            if new.get("errors", 0) > old.get("errors", 0):
+                regressions.append("%s/%s: %d errors, was %d" % (stage, name, new["errors"], old["errors"]))
+            if new.get("mismatches", 0) > old.get("mismatches", 0):
+                regressions.append("%s/%s: %d files with wrong values, was %d"
+                                   % (stage, name, new["mismatches"], old.get("mismatches", 0)))
+
+            print("  %-8s %s" % (name, ", ".join(changes)))
+
+    if regressions:
+        print("\nregressions (more than %.1f%%):" % threshold)
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+
+    print("\nno regressions")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the nemo-media-columns extractors.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--corpus", default=DEFAULT_CORPUS,
+                            help="where the synthetic corpus is kept (default: %(default)s)")
+    run_parser.add_argument("--scale", type=int, default=media_corpus.DEFAULT_SCALE,
+                            help="files of each format (default: %(default)s)")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                            help="timed runs of each file (default: %(default)s)")
+    run_parser.add_argument("--stages", nargs="+", choices=[stage.name for stage in STAGES],
+                            help="only run these stages")
+    run_parser.add_argument("--formats", nargs="+", choices=sorted(media_corpus.FORMATS),
+                            help="only time these formats")
+    run_parser.add_argument("--timeout", type=float, default=30.0,
+                            help="the extension's per file timeout, in seconds (default: %(default)s)")
+    run_parser.add_argument("--output", help="write the results to this JSON file")
+    run_parser.add_argument("--compare", metavar="BASELINE", help="compare the results to an earlier JSON file")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help="slowdown that counts as a regression, in percent (default: %(default)s)")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="slowdown that counts as a regression, in percent (default: %(default)s)")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.results) as f:
+            results = json.load(f)
+        return compare(baseline, results, args.threshold)
+
+    return run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+#!/usr/bin/python3
+
+# Synthetic corpus for the nemo-media-columns benchmarks.
+#
+# Every file is generated from its index alone, so the same scale always
+# gives the same corpus, byte for byte - results from different machines or
+# different versions of the code measure the same work.  MP3, FLAC, WAV, AVI
+# and PDF files are written by hand; JPEG and PNG need PIL, and the MKV and
+# MP4 files need ffmpeg, and are left out (with a note) if they're missing.
+#
+# Audio payloads are silence and video frames are blank - the extractors only
+# ever look at the headers and tags, and it keeps the corpus small.
+#
+# Every file records the values the extractors should find in it in the
+# manifest, under "expected", for the benchmarks to check.
+
+import os
+import sys
+import json
+import struct
+import shutil
+import subprocess
+
+# Bump whenever the generated files change, so old corpora are rebuilt.
+CORPUS_VERSION = 3
+
+MANIFEST = "manifest.json"
+
+DEFAULT_SCALE = 20
+
+# format -> (mimetype, extension)
+FORMATS = {
+    "mp3": ("audio/mpeg", "mp3"),
+    "flac": ("audio/flac", "flac"),
+    "wav": ("audio/x-wav", "wav"),
+    "jpeg": ("image/jpeg", "jpg"),
+    "png": ("image/png", "png"),
+    "pdf": ("application/pdf", "pdf"),
+    "avi": ("video/x-msvideo", "avi"),
+    "mkv": ("video/x-matroska", "mkv"),
+    "mp4": ("video/mp4", "mp4"),
+}
+
+GENRES = ("Rock", "Jazz", "Classical", "Electronic", "Folk", "Hip-Hop", "Ambient")
+
+def tag_values(index):
+    return {
+        "title": "Track %d – synthetic" % index,
+        "artist": "Artist %d" % (index % 7),
+        "album": "Album %d" % (index % 3),
+        "tracknumber": "%d" % (index % 12 + 1),
+        "genre": GENRES[index % len(GENRES)],
+        "date": "%d" % (1970 + index % 50),
+        "composer": "Composer %d" % (index % 5),
+        "description": "Generated for the benchmarks, file %d" % index,
+    }
+
+# MP3
+
+MP3_FRAME_HEADER = b"\xff\xfb\x90\x00"  # MPEG-1 layer III, 128 kbps, 44.1 kHz, stereo
+MP3_FRAME_SIZE = 144 * 128000 // 44100
+
+def synchsafe(value):
+    return bytes(((value >> shift) & 0x7f) for shift in (21, 14, 7, 0))
+
+def id3_frame(frame_id, body):
+    return frame_id.encode() + synchsafe(len(body)) + b"\x00\x00" + body
+
+def id3_text(frame_id, text):
+    return id3_frame(frame_id, b"\x03" + text.encode("utf-8"))
+
+def mp3_values(index):
+    tags = tag_values(index)
+    # 10 seconds to a few minutes.
+    frame_count = 383 + index * 250
+
+    return {"title": tags["title"], "artist": tags["artist"], "album": tags["album"],
+            "tracknumber": "%02d" % int(tags["tracknumber"]), "genre": tags["genre"], "date": tags["date"],
+            "composer": tags["composer"], "bitrate": 128000, "samplerate": 44100,
+            "length": frame_count * 1152 / 44100}
+
+def make_mp3(index):
+    tags = tag_values(index)
+    frames = [id3_text("TIT2", tags["title"]), id3_text("TPE1", tags["artist"]),
+              id3_text("TALB", tags["album"]), id3_text("TRCK", tags["tracknumber"]),
+              id3_text("TCON", tags["genre"]), id3_text("TDRC", tags["date"]),
+              id3_text("TCOM", tags["composer"]),
+              id3_frame("COMM", b"\x03eng\x00" + tags["description"].encode("utf-8"))]
+
+    # Every other file has cover art too big for the first read of the file.
+    if index % 2:
+        frames.append(id3_frame("APIC", b"\x00image/jpeg\x00\x03\x00" + bytes(96 * 1024 + index)))
+
+    body = b"".join(frames) + bytes(256)
+    tag = b"ID3\x04\x00\x00" + synchsafe(len(body)) + body
+
+    frame_count = round(mp3_values(index)["length"] * 44100 / 1152)
+    audio = (MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - 4)) * frame_count
+
+    return tag + audio
+
+# FLAC
+
+def flac_block(block_type, body, last=False):
+    return bytes([block_type | (0x80 if last else 0)]) + struct.pack(">I", len(body))[1:] + body
+
+def flac_values(index):
+    values = dict(tag_values(index))
+    values["samplerate"] = (44100, 48000, 96000)[index % 3]
+    values["length"] = float(10 + index * 7)
+
+    return values
+
+def make_flac(index):
+    tags = tag_values(index)
+    sample_rate = flac_values(index)["samplerate"]
+    samples = sample_rate * int(flac_values(index)["length"])
+
+    streaminfo = struct.pack(">HH", 4096, 4096) + bytes(6)
+    # sample rate (20 bits), channels - 1 (3), bits per sample - 1 (5), total samples (36)
+    packed = (sample_rate << 44) | (1 << 41) | (15 << 36) | samples
+    streaminfo += packed.to_bytes(8, "big") + bytes(16)
+
+    vendor = b"nemo-media-columns benchmark"
+    comments = ["TITLE=" + tags["title"], "ARTIST=" + tags["artist"], "ALBUM=" + tags["album"],
+                "TRACKNUMBER=" + tags["tracknumber"], "GENRE=" + tags["genre"], "DATE=" + tags["date"],
+                "COMPOSER=" + tags["composer"], "DESCRIPTION=" + tags["description"]]
+    vorbis = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for comment in comments:
+        comment = comment.encode("utf-8")
+        vorbis += struct.pack("<I", len(comment)) + comment
+
+    # Stands in for the compressed audio, about 1/8 of the raw size.
+    audio = bytes(samples * 4 // 8)
+
+    return (b"fLaC" + flac_block(0, streaminfo) + flac_block(4, vorbis) +
+            flac_block(1, bytes(8192), last=True) + audio)
+
+# WAV
+
+def wav_values(index):
+    return {"samplerate": (22050, 44100, 48000)[index % 3], "length": float(1 + index % 4)}
+
+def make_wav(index):
+    sample_rate = wav_values(index)["samplerate"]
+    data = bytes(sample_rate * 4 * int(wav_values(index)["length"]))
+    fmt = struct.pack("<HHIIHH", 1, 2, sample_rate, sample_rate * 4, 4, 16)
+
+    return (b"RIFF" + struct.pack("<I", 4 + 8 + len(fmt) + 8 + len(data)) + b"WAVE" +
+            b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(data)) + data)
+
+# AVI
+
+AVI_FRAME_RATE = 25
+
+def riff_chunk(fourcc, body):
+    return fourcc + struct.pack("<I", len(body)) + body + (b"\x00" if len(body) % 2 else b"")
+
+def riff_list(list_type, body):
+    return riff_chunk(b"LIST", list_type + body)
+
+def avi_values(index):
+    width, height = ((320, 240), (640, 360), (1280, 720))[index % 3]
+
+    return {"width": width, "height": height, "length": float(1 + index % 3)}
+
+def make_avi(index):
+    # Motion JPEG, as far as the headers go - the frames themselves are
+    # placeholders, which MediaInfo never decodes.
+    values = avi_values(index)
+    width, height = values["width"], values["height"]
+    frame_count = int(values["length"]) * AVI_FRAME_RATE
+    frame = riff_chunk(b"00dc", bytes(64))
+
+    avih = struct.pack("<10I16x", 1000000 // AVI_FRAME_RATE, 0, 0, 0x10, frame_count, 0, 1, 0, width, height)
+    strh = struct.pack("<4s4sIHHIIIIIIIIhhhh", b"vids", b"MJPG", 0, 0, 0, 0, 1, AVI_FRAME_RATE, 0,
+                       frame_count, 0, 0xffffffff, 0, 0, 0, width, height)
+    strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+    header = riff_list(b"hdrl", riff_chunk(b"avih", avih) +
+                       riff_list(b"strl", riff_chunk(b"strh", strh) + riff_chunk(b"strf", strf)))
+
+    movi = riff_list(b"movi", frame * frame_count)
+    index_entries = b"".join(struct.pack("<4sIII", b"00dc", 0x10, 4 + i * len(frame), 64)
+                             for i in range(frame_count))
+    body = b"AVI " + header + movi + riff_chunk(b"idx1", index_entries)
+
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+# JPEG / PNG
+
+def image_values(index):
+    width, height = ((320, 240), (1024, 768), (1920, 1080), (4000, 3000))[index % 4]
+
+    return {"width": width, "height": height, "exif_software": "nemo-media-columns benchmark",
+            "exif_datetime_original": "2019-06-%02d 08:30:00" % (index % 28 + 1),
+            "exif_flash": "16" if index % 2 else "9"}
+
+def make_image(index, image_format):
+    import io
+    from PIL import Image
+
+    values = image_values(index)
+    image = Image.new("RGB", (values["width"], values["height"]), ((index * 37) % 256, (index * 91) % 256, (index * 13) % 256))
+
+    exif = Image.Exif()
+    exif[0x0131] = "nemo-media-columns benchmark"
+    exif[0x0132] = "2020:01:%02d 12:00:00" % (index % 28 + 1)
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = "2019:06:%02d 08:30:00" % (index % 28 + 1)
+    exif_ifd[0x9209] = 16 if index % 2 else 9
+
+    data = io.BytesIO()
+    image.save(data, image_format, exif=exif)
+
+    return data.getvalue()
+
+# PDF
+
+PDF_PAGES_PER_NODE = 100
+
+def pdf_values(index):
+    # The last few files run to thousands of pages, in a two-level page tree
+    # like real documents have.
+    return {"title": "Document %d" % index, "artist": "Author %d" % (index % 5),
+            "pages": 2000 + index * 250 if index % 5 == 4 else 1 + index * 3}
+
+def make_pdf(index):
+    page_count = pdf_values(index)["pages"]
+    objects = {}
+
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[3] = ("<< /Title (Document %d) /Author (Author %d) /Producer (nemo-media-columns benchmark) >>"
+                  % (index, index % 5)).encode()
+    stream = b"BT /F1 12 Tf 72 720 Td (Synthetic page) Tj ET"
+    objects[4] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+    objects[5] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    next_id = 6
+    nodes = []
+
+    for first in range(0, page_count, PDF_PAGES_PER_NODE):
+        node_id = next_id
+        next_id += 1
+        kids = []
+
+        for page in range(first, min(first + PDF_PAGES_PER_NODE, page_count)):
+            objects[next_id] = (b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                                b"/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>" % node_id)
+            kids.append(next_id)
+            next_id += 1
+
+        objects[node_id] = (b"<< /Type /Pages /Parent 2 0 R /Count %d /Kids [%s] >>"
+                            % (len(kids), b" ".join(b"%d 0 R" % kid for kid in kids)))
+        nodes.append(node_id)
+
+    objects[2] = (b"<< /Type /Pages /Count %d /Kids [%s] >>"
+                  % (page_count, b" ".join(b"%d 0 R" % node for node in nodes)))
+
+    data = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    offsets = {}
+
+    for object_id in sorted(objects):
+        offsets[object_id] = len(data)
+        data += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % next_id
+    data += b"".join(b"%010d 00000 n \n" % offsets[object_id] for object_id in range(1, next_id))
+    data += b"trailer\n<< /Size %d /Root 1 0 R /Info 3 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_id, xref)
+
+    return data
+
+# MKV / MP4
+
+def video_values(index):
+    # The length depends on how ffmpeg pads the streams, so isn't checked.
+    width, height = ((320, 240), (640, 360), (1280, 720))[index % 3]
+
+    return {"width": width, "height": height}
+
+def make_video(index, path, container):
+    tags = tag_values(index)
+    size = "%(width)dx%(height)d" % video_values(index)
+    duration = str(1 + index % 3)
+
+    subprocess.run(["ffmpeg", "-v", "error", "-y",
+                    "-f", "lavfi", "-i", "testsrc=size=%s:rate=25:duration=%s" % (size, duration),
+                    "-f", "lavfi", "-i", "sine=frequency=%d:duration=%s" % (220 + index * 10, duration),
+                    "-c:v", "mpeg4", "-c:a", "aac", "-fflags", "+bitexact",
+                    "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+                    "-metadata", "title=" + tags["title"], "-metadata", "artist=" + tags["artist"],
+                    "-f", "matroska" if container == "mkv" else "mp4", path],
+                   check=True, stdin=subprocess.DEVNULL)
+
+# format -> the values of the file with that index, as the extractors give
+# them.
+EXPECTED_VALUES = {
+    "mp3": mp3_values,
+    "flac": flac_values,
+    "wav": wav_values,
+    "jpeg": image_values,
+    "png": image_values,
+    "pdf": pdf_values,
+    "avi": avi_values,
+    "mkv": video_values,
+    "mp4": video_values,
+}
+
+def generate(directory, scale=DEFAULT_SCALE):
+    # Writes the corpus to directory, unless it's already there, and returns
+    # its manifest: a list of {"path", "format", "mimetype", "size"}.
+    manifest_path = os.path.join(directory, MANIFEST)
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["version"] == CORPUS_VERSION and manifest["scale"] == scale:
+            return manifest["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    have_pil = True
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+
+    try:
+        import PIL.Image
+    except ImportError:
+        have_pil = False
+
+    if not have_pil:
+        print("media_corpus: PIL is not installed, leaving out the JPEG and PNG files", file=sys.stderr)
+    if not have_ffmpeg:
+        print("media_corpus: ffmpeg was not found, leaving out the MKV and MP4 files", file=sys.stderr)
+
+    for file_format, (mimetype, extension) in FORMATS.items():
+        if file_format in ("jpeg", "png") and not have_pil:
+            continue
+        if file_format in ("mkv", "mp4") and not have_ffmpeg:
+            continue
+
+        # Video files are slow to make and all go through the same parser.
+        count = max(1, scale // 4) if file_format in ("mkv", "mp4") else scale
+
+        for index in range(count):
+            path = os.path.join(directory, "%s-%03d.%s" % (file_format, index, extension))
+
+            if file_format in ("mkv", "mp4"):
+                make_video(index, path, file_format)
+            else:
+                if file_format == "mp3":
+                    data = make_mp3(index)
+                elif file_format == "flac":
+                    data = make_flac(index)
+                elif file_format == "wav":
+                    data = make_wav(index)
+                elif file_format == "avi":
+                    data = make_avi(index)
+                elif file_format in ("jpeg", "png"):
+                    data = make_image(index, file_format.upper())
+                else:
+                    data = make_pdf(index)
+
+                with open(path, "wb") as f:
+                    f.write(data)
+
+            files.append({"path": os.path.basename(path), "format": file_format,
+                          "mimetype": mimetype, "size": os.path.getsize(path),
+                          "expected": EXPECTED_VALUES[file_format](index)})
+
+    with open(manifest_path, "w") as f:
+        json.dump({"version": CORPUS_VERSION, "scale": scale, "files": files}, f, indent=1)
+
+    return files
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: %s DIRECTORY [SCALE]" % sys.argv[0], file=sys.stderr)
+        sys.exit(2)
+
+    files = generate(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SCALE)
+    print("%d files, %.1f MiB" % (len(files), sum(f["size"] for f in files) / (1024 * 1024)))
@@ -0,0 +1,478 @@
+#!/usr/bin/python3
+
+# Fast header readers for MP3 and FLAC files.
+#
+# Everything the columns need lives at the start of these files (ID3v2 tags,
+# the first MPEG frame with its Xing/VBRI header, FLAC metadata blocks) or in
+# the last 128 bytes (ID3v1), so one read of the head and one of the tail are
+# usually enough - unlike the general purpose libraries, which may scan much
+# further.  Large embedded pictures are stepped over rather than read.  The
+# readers return None whenever they're unsure, and the caller falls back to
+# mutagen or MediaInfo.
+
+import re
+import struct
+
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 128
+
+# Used when the audio data or a metadata block starts past the head.
+WINDOW_SIZE = 8 * 1024
+MAX_BLOCK_SIZE = 256 * 1024
+
+# ID3v2 text frames, by tag version, and the (EasyID3) keys we read from them.
+ID3_FRAMES = {
+    2: {b"TT2": "title", b"TAL": "album", b"TP1": "artist", b"TRK": "tracknumber",
+        b"TCO": "genre", b"TYE": "year", b"TDA": "tdat", b"TIM": "time", b"TCM": "composer",
+        b"TT3": "version"},
+    3: {b"TIT2": "title", b"TALB": "album", b"TPE1": "artist", b"TRCK": "tracknumber",
+        b"TCON": "genre", b"TYER": "year", b"TDAT": "tdat", b"TIME": "time", b"TCOM": "composer",
+        b"TIT3": "version", b"TDRC": "date"},
+    4: {b"TIT2": "title", b"TALB": "album", b"TPE1": "artist", b"TRCK": "tracknumber",
+        b"TCON": "genre", b"TDRC": "date", b"TCOM": "composer", b"TIT3": "version"},
+}
+
+TAG_KEYS = ("title", "album", "artist", "tracknumber", "genre", "date", "composer", "version")
+
+ID3_ENCODINGS = ("latin-1", "utf-16", "utf-16-be", "utf-8")
+
+MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+MPEG_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+
+# FLAC Vorbis comment fields, and the keys MediaInfo reports them as.
+VORBIS_FIELDS = {"TITLE": "title", "ARTIST": "artist", "ALBUM": "album", "GENRE": "genre",
+                 "TRACKNUMBER": "tracknumber", "DATE": "date", "DESCRIPTION": "description",
+                 "COMPOSER": "composer"}
+
+class HeaderError(Exception):
+    pass
+
+def syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def read_head_tail(source):
+    size = source.size
+    head = source.pread(HEAD_SIZE, 0)
+
+    if size <= HEAD_SIZE:
+        tail = head[-TAIL_SIZE:]
+    else:
+        tail = source.pread(TAIL_SIZE, size - TAIL_SIZE)
+
+    return size, head, tail
+
+def read_window(source, head, offset, length, base=0):
+    # Bytes at offset in the file, from head (which was read at base) if
+    # it covers them.
+    if base <= offset and offset + length <= base + len(head):
+        return head[offset - base:offset - base + length]
+
+    return source.pread(length, offset)
+
+def id3v2_size(head):
+    # Total size of an ID3v2 tag at the start of the file, or 0.
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+
+    size = 10 + syncsafe(head[6:10])
+
+    if head[3] == 4 and head[5] & 0x10:
+        size += 10
+
+    return size
+
+def decode_text(data):
+    if not data or data[0] >= len(ID3_ENCODINGS):
+        raise HeaderError("bad text encoding")
+
+    text = data[1:].decode(ID3_ENCODINGS[data[0]])
+
+    # Several values are separated by nulls, EasyID3 gives us the first.
+    for value in text.split("\x00"):
+        value = value.lstrip("\ufeff")
+        if value:
+            return value
+
+    return None
+
+def parse_id3v2(source, head):
+    # Returns a dict of TAG_KEYS, and of the "year", "tdat" and "time" frames
+    # of older tags, for upgrade_date().  Frames we don't need (cover art,
+    # mostly) are skipped over, even when they run past the end of head.
+    major = head[3]
+    flags = head[5]
+    tag_end = 10 + syncsafe(head[6:10])
+
+    if major not in ID3_FRAMES:
+        raise HeaderError("unsupported ID3v2.%d tag" % major)
+
+    if flags & 0x80 and major < 4:
+        # Whole-tag unsynchronisation (ID3v2.4 does it per frame) - frame
+        # offsets are only known after undoing it.
+        if tag_end > len(head):
+            raise HeaderError("unsynchronised tag larger than our read")
+
+        data = head[10:tag_end].replace(b"\xff\x00", b"\xff")
+        head = head[:10] + data
+        tag_end = len(head)
+
+    pos = 10
+
+    if flags & 0x40:
+        if major == 3:
+            pos += 4 + struct.unpack(">I", head[10:14])[0]
+        elif major == 4:
+            pos += syncsafe(head[10:14])
+
+    frames = ID3_FRAMES[major]
+    header_size = 6 if major == 2 else 10
+    values = {}
+
+    while pos + header_size <= tag_end:
+        header = read_window(source, head, pos, header_size)
+
+        if len(header) < header_size or header[0] == 0:
+            # padding
+            break
+
+        if major == 2:
+            frame_id = header[:3]
+            size = int.from_bytes(header[3:6], "big")
+            frame_flags = 0
+        else:
+            frame_id = header[:4]
+            size = syncsafe(header[4:8]) if major == 4 else struct.unpack(">I", header[4:8])[0]
+            frame_flags = struct.unpack(">H", header[8:10])[0]
+
+        if not re.fullmatch(rb"[A-Z0-9]+", frame_id):
+            raise HeaderError("bad frame id %r" % frame_id)
+
+        start = pos + header_size
+        pos = start + size
+
+        if pos > tag_end:
+            raise HeaderError("frame runs past the end of the tag")
+
+        key = frames.get(frame_id)
+
+        if key is None or key in values:
+            continue
+
+        if size > MAX_BLOCK_SIZE:
+            raise HeaderError("oversized text frame")
+
+        body = read_window(source, head, start, size)
+
+        if major == 3:
+            if frame_flags & 0x00c0:
+                raise HeaderError("compressed or encrypted frame")
+            if frame_flags & 0x0020:
+                body = body[1:]
+        elif major == 4:
+            if frame_flags & 0x000c:
+                raise HeaderError("compressed or encrypted frame")
+            if frame_flags & 0x0040:
+                body = body[1:]
+            if frame_flags & 0x0001:
+                body = body[4:]
+            if frame_flags & 0x0002 or flags & 0x80:
+                body = body.replace(b"\xff\x00", b"\xff")
+
+        value = decode_text(body)
+
+        if value is not None:
+            values[key] = value
+
+    return values
+
+def upgrade_date(values):
+    # mutagen upgrades the ID3v2.2/2.3 date frames to a single TDRC, if TYER
+    # is a year.
+    year = re.match(r"([0-9]{4})(-[0-9]{2}-[0-9]{2})?\Z", values.pop("year", ""))
+    tdat = re.match(r"([0-9]{2})([0-9]{2})\Z", values.pop("tdat", ""))
+    time = re.match(r"([0-9]{2})([0-9]{2})\Z", values.pop("time", ""))
+
+    if year and "date" not in values:
+        date, month_day = year.groups()
+
+        if tdat:
+            month_day = "-%s-%s" % tdat.groups()[::-1]
+        if month_day:
+            date += month_day
+            if time:
+                date += "T%s:%s:00" % time.groups()
+
+        values["date"] = date
+
+def format_timestamp(text):
+    # The date as EasyID3 gives it, through mutagen's ID3TimeStamp: split
+    # into its numbers, and put back together as "YYYY-MM-DD HH:MM:SS", up
+    # to the first part that's missing.
+    parts = re.split(r"[-T:/.]|\s+", text + ":::::")[:6]
+    pieces = []
+
+    for i, part in enumerate(parts):
+        try:
+            value = int(part)
+        except ValueError:
+            break
+
+        pieces.append(("%04d" if i == 0 else "%02d") % value + "-- ::x"[i])
+
+    return "".join(pieces)[:-1]
+
+def parse_id3v1(tail):
+    if len(tail) < 128 or tail[:3] != b"TAG":
+        return None
+
+    def fix(data):
+        return data.split(b"\x00")[0].strip().decode("latin-1")
+
+    values = {}
+
+    for key, field in (("title", tail[3:33]), ("artist", tail[33:63]),
+                       ("album", tail[63:93]), ("date", tail[93:97])):
+        value = fix(field)
+        if value:
+            values[key] = value
+
+    if tail[125] == 0 and tail[126] != 0:
+        values["tracknumber"] = str(tail[126])
+
+    # 255 means no genre, anything else would need mutagen's genre table.
+    if tail[127] != 0xff:
+        values["genre"] = str(tail[127])
+
+    return values
+
+def parse_mpeg_header(data, pos):
+    # Returns (version, layer, bitrate, sample rate, frame length, mono) or None.
+    if pos + 4 > len(data):
+        return None
+
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+
+    if data[pos] != 0xff or b1 & 0xe0 != 0xe0:
+        return None
+
+    version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 0x3)
+    layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 0x3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x3
+
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x1
+    mono = (b3 >> 6) == 3
+
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        length = (samples_per_frame(version, layer) // 8) * bitrate // sample_rate + padding
+
+    return version, layer, bitrate, sample_rate, length, mono
+
+def samples_per_frame(version, layer):
+    if layer == 1:
+        return 384
+    if layer == 3 and version != 1:
+        return 576
+    return 1152
+
+def find_mpeg_frame(data):
+    # The first frame header that is followed by another one.
+    for pos in range(len(data) - 4):
+        if data[pos] != 0xff:
+            continue
+
+        header = parse_mpeg_header(data, pos)
+
+        if header is None:
+            continue
+
+        following = pos + header[4]
+
+        if following + 4 <= len(data) and parse_mpeg_header(data, following) is None:
+            continue
+
+        return pos, header
+
+    raise HeaderError("no MPEG frame found")
+
+def parse_mpeg_stream(data, audio_size):
+    # Returns (bitrate, sample rate, length) for the stream starting in data.
+    pos, (version, layer, bitrate, sample_rate, frame_length, mono) = find_mpeg_frame(data)
+    samples = samples_per_frame(version, layer)
+
+    frames = None
+    stream_bytes = None
+
+    if version == 1:
+        xing = pos + (21 if mono else 36)
+    else:
+        xing = pos + (13 if mono else 21)
+
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        xing_flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        field = xing + 8
+
+        if xing_flags & 0x1:
+            frames = struct.unpack(">I", data[field:field + 4])[0]
+            field += 4
+        if xing_flags & 0x2:
+            stream_bytes = struct.unpack(">I", data[field:field + 4])[0]
+    elif data[pos + 36:pos + 40] == b"VBRI":
+        stream_bytes, frames = struct.unpack(">II", data[pos + 46:pos + 54])
+
+    audio_size -= pos
+
+    if frames:
+        length = frames * samples / sample_rate
+        if length > 0:
+            bitrate = int((stream_bytes or audio_size) * 8 / length)
+    else:
+        length = audio_size * 8 / bitrate
+
+    return bitrate, sample_rate, length
+
+def read_mp3(source, tags=True, stream=True):
+    # Returns a dict with the TAG_KEYS that were found if tags is set, and
+    # "bitrate" (bits/s), "samplerate" (Hz) and "length" (seconds) if stream
+    # is set.  Returns None if the file needs a closer look.  source is a
+    # media_source.Source.
+    try:
+        size, head, tail = read_head_tail(source)
+        tag_size = id3v2_size(head)
+        has_v1 = size >= 128 and tail[:3] == b"TAG"
+        values = {}
+
+        if tags:
+            if tag_size:
+                values = parse_id3v2(source, head)
+
+            # As mutagen does, the ID3v1 year of a file with an older ID3v2
+            # tag goes in as its TYER, before the date frames are upgraded.
+            if has_v1:
+                for key, value in parse_id3v1(tail).items():
+                    if key == "date" and tag_size and head[3] < 4:
+                        key = "year"
+                    values.setdefault(key, value)
+
+            upgrade_date(values)
+
+            if "date" in values:
+                values["date"] = format_timestamp(values["date"])
+
+            genre = values.get("genre", "")
+
+            # Numeric genre references (ID3v1 ones included) need mutagen's
+            # genre table.
+            if genre[:1] == "(" or genre.isdigit():
+                return None
+
+        if stream:
+            audio_size = size - tag_size - (128 if has_v1 else 0)
+            window = read_window(source, head, tag_size, WINDOW_SIZE)
+            values["bitrate"], values["samplerate"], values["length"] = parse_mpeg_stream(window, audio_size)
+
+        return values
+    except (HeaderError, IndexError, struct.error, UnicodeDecodeError, ZeroDivisionError, OSError):
+        return None
+
+def read_flac(source, tags=True):
+    # Returns a dict with "samplerate" (Hz), "length" (seconds), "bitrate"
+    # (bits/s, overall) and, if tags is set, the Vorbis comments as the keys
+    # of VORBIS_FIELDS.  Returns None if the file needs a closer look.
+    try:
+        size, head, tail = read_head_tail(source)
+        base = id3v2_size(head)
+
+        if base:
+            head = read_window(source, head, base, HEAD_SIZE)
+
+        if head[:4] != b"fLaC":
+            raise HeaderError("not a FLAC stream")
+
+        values = {}
+        block_pos = base + 4
+        last = False
+        comments = None
+
+        while not last:
+            header = read_window(source, head, block_pos, 4, base)
+
+            if len(header) < 4:
+                raise HeaderError("truncated metadata")
+
+            last = header[0] & 0x80
+            block_type = header[0] & 0x7f
+            length = int.from_bytes(header[1:4], "big")
+            start = block_pos + 4
+            block_pos = start + length
+
+            if block_type == 0:
+                block = read_window(source, head, start, length, base)
+                fields = int.from_bytes(block[10:18], "big")
+                sample_rate = fields >> 44
+                total_samples = fields & 0xfffffffff
+
+                if not sample_rate or not total_samples:
+                    raise HeaderError("unknown stream length")
+
+                values["samplerate"] = sample_rate
+                values["length"] = total_samples / sample_rate
+                values["bitrate"] = int(size * 8 / values["length"])
+
+                if not tags:
+                    break
+            elif block_type == 4 and tags:
+                if length > MAX_BLOCK_SIZE:
+                    raise HeaderError("oversized comment block")
+                comments = read_window(source, head, start, length, base)
+
+        if "samplerate" not in values:
+            raise HeaderError("no STREAMINFO block")
+
+        if comments is not None:
+            vendor_length = struct.unpack("<I", comments[:4])[0]
+            pos = 4 + vendor_length
+            count = struct.unpack("<I", comments[pos:pos + 4])[0]
+            pos += 4
+            found = {}
+
+            for i in range(count):
+                length = struct.unpack("<I", comments[pos:pos + 4])[0]
+                comment = comments[pos + 4:pos + 4 + length].decode("utf-8")
+                pos += 4 + length
+
+                name, _, value = comment.partition("=")
+                key = VORBIS_FIELDS.get(name.upper())
+
+                if key is not None and value:
+                    found.setdefault(key, []).append(value)
+
+            # MediaInfo joins repeated fields.
+            for key, items in found.items():
+                values[key] = " / ".join(items)
+
+            if "tracknumber" in values:
+                values["tracknumber"] = values["tracknumber"].split("/")[0]
+
+        return values
+    except (HeaderError, IndexError, struct.error, UnicodeDecodeError, ZeroDivisionError, OSError):
+        return None
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+
+# Persistent metadata cache for nemo-media-columns.
+#
+# Extracted column values are stored in an SQLite database under the user
+# cache dir, keyed by path and validated against the file's inode, size and
+# mtime, so unchanged files never have to be parsed twice.  Files that
+# couldn't be parsed are recorded the same way, with the error and the time
+# wasted on them, so they aren't retried until they change.  The database is
+# opened in WAL mode so several Nemo processes can share it safely.
+#
+# The fields people search on are indexed, along with each file's mime type,
+# so that nemo-media-columns-query can answer from here (see media_query.py).
+#
+# Run as a script, it lists the files that failed most often.
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+from gi.repository import GLib
+
+from media_info import FIELDS, TEXT_FIELDS
+
+SCHEMA_VERSION = 5
+
+DEFAULT_PATH = os.path.join(GLib.get_user_cache_dir(), "nemo-media-columns", "metadata.db")
+DEFAULT_MAX_ENTRIES = 200000
+
+# Don't rewrite the access time of an entry on every hit, it's only used to
+# pick eviction candidates.
+ACCESS_GRANULARITY = 3600
+
+# How many stores between checks of the table size.
+TRIM_INTERVAL = 500
+
+# How long to wait for another process holding the write lock (seconds).
+BUSY_TIMEOUT = 5.0
+
+# How many failed files we remember.
+MAX_FAILURES = 10000
+
+# The columns media_query.py searches on.  Text ones are matched ignoring
+# case.
+INDEXED_TEXT_FIELDS = ("artist", "album", "genre", "date", "exif_datetime_original")
+INDEXED_NUMBER_FIELDS = ("length", "width", "height", "pages")
+
+class MetadataCache():
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stores_since_trim = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                                    isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        self._ensure_schema()
+        self.trim()
+
+    def _ensure_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+        if version == SCHEMA_VERSION:
+            return
+
+        # Anything older is simply thrown away - it's only a cache.
+        columns = ", ".join("%s %s" % (field, "TEXT" if field in TEXT_FIELDS else "NUMERIC")
+                            for field in FIELDS)
+
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            # Another Nemo process may have beaten us to it.
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+                return
+
+            self.conn.execute("DROP TABLE IF EXISTS media")
+            self.conn.execute("DROP TABLE IF EXISTS failures")
+            self.conn.execute("CREATE TABLE media (path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, "
+                              "mtime INTEGER, last_used INTEGER, computed TEXT, mimetype TEXT, %s)" % columns)
+            self.conn.execute("CREATE INDEX media_last_used ON media (last_used)")
+            self.conn.execute("CREATE INDEX media_mimetype ON media (mimetype)")
+            for field in INDEXED_TEXT_FIELDS:
+                self.conn.execute("CREATE INDEX media_%s ON media (%s COLLATE NOCASE)" % (field, field))
+            for field in INDEXED_NUMBER_FIELDS:
+                self.conn.execute("CREATE INDEX media_%s ON media (%s)" % (field, field))
+            # count is how many times the file failed, across versions of it.
+            self.conn.execute("CREATE TABLE failures (path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, "
+                              "mtime INTEGER, failed INTEGER, error TEXT, cost REAL, count INTEGER)")
+            self.conn.execute("CREATE INDEX failures_failed ON failures (failed)")
+            self.conn.execute("PRAGMA user_version=%d" % SCHEMA_VERSION)
+
+    def lookup(self, path, stat):
+        # Returns a dict of FileExtensionInfo fields and the set of attributes
+        # that were actually extracted (the others weren't asked for), or None
+        # if there's no valid entry for this version of the file.
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT inode, size, mtime, last_used, computed, %s FROM media WHERE path=?"
+                                        % ", ".join(FIELDS), (path,)).fetchone()
+            except sqlite3.Error as e:
+                print("nemo-media-columns: cache lookup failed for '%s': %s" % (path, e))
+                return None
+
+            if row is None:
+                return None
+
+            inode, size, mtime, last_used = row[:4]
+
+            if (inode, size, mtime) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                return None
+
+            now = int(time.time())
+
+            if now - last_used > ACCESS_GRANULARITY:
+                try:
+                    self.conn.execute("UPDATE media SET last_used=? WHERE path=?", (now, path))
+                except sqlite3.Error:
+                    pass
+
+        return dict(zip(FIELDS, row[5:])), frozenset(row[4].split())
+
+    def store(self, path, stat, info, computed, mimetype=None):
+        values = [getattr(info, field) for field in FIELDS]
+
+        with self.lock:
+            try:
+                self.conn.execute("INSERT OR REPLACE INTO media (path, inode, size, mtime, last_used, computed, "
+                                  "mimetype, %s) VALUES (?, ?, ?, ?, ?, ?, ?, %s)"
+                                  % (", ".join(FIELDS), ", ".join("?" * len(FIELDS))),
+                                  [path, stat.st_ino, stat.st_size, stat.st_mtime_ns, int(time.time()),
+                                   " ".join(sorted(computed)), mimetype] + values)
+            except sqlite3.Error as e:
+                print("nemo-media-columns: cache store failed for '%s': %s" % (path, e))
+                return
+
+            self.stores_since_trim += 1
+
+        if self.stores_since_trim >= TRIM_INTERVAL:
+            self.trim()
+
+    def lookup_failure(self, path, stat):
+        # The error this version of the file failed with, or None.
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT inode, size, mtime, error FROM failures WHERE path=?",
+                                        (path,)).fetchone()
+            except sqlite3.Error as e:
+                print("nemo-media-columns: cache lookup failed for '%s': %s" % (path, e))
+                return None
+
+        if row is None or tuple(row[:3]) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return None
+
+        return row[3]
+
+    def store_failure(self, path, stat, error, cost):
+        # cost is the time spent on the file before giving up (seconds).
+        with self.lock:
+            try:
+                self.conn.execute("INSERT INTO failures (path, inode, size, mtime, failed, error, cost, count) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, 1) "
+                                  "ON CONFLICT (path) DO UPDATE SET inode=excluded.inode, size=excluded.size, "
+                                  "mtime=excluded.mtime, failed=excluded.failed, error=excluded.error, "
+                                  "cost=excluded.cost, count=count + 1",
+                                  (path, stat.st_ino, stat.st_size, stat.st_mtime_ns, int(time.time()), error, cost))
+            except sqlite3.Error as e:
+                print("nemo-media-columns: cache store failed for '%s': %s" % (path, e))
+                return
+
+            self.stores_since_trim += 1
+
+    def get_failures(self, limit=50):
+        # The worst offenders first: (path, error, cost, count, failed).
+        with self.lock:
+            try:
+                return self.conn.execute("SELECT path, error, cost, count, failed FROM failures "
+                                         "ORDER BY count DESC, cost DESC LIMIT ?", (limit,)).fetchall()
+            except sqlite3.Error as e:
+                print("nemo-media-columns: could not read the failures from the cache: %s" % e)
+                return []
+
+    def evict(self, path):
+        with self.lock:
+            try:
+                self.conn.execute("DELETE FROM media WHERE path=?", (path,))
+                self.conn.execute("DELETE FROM failures WHERE path=?", (path,))
+            except sqlite3.Error:
+                pass
+
+    def trim(self):
+        # Drop the least recently used entries, leaving some headroom so we
+        # don't end up trimming again on the very next store.
+        with self.lock:
+            self.stores_since_trim = 0
+
+            try:
+                for table, limit, order in (("media", self.max_entries, "last_used"),
+                                            ("failures", MAX_FAILURES, "failed")):
+                    count = self.conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+
+                    if count <= limit:
+                        continue
+
+                    excess = count - int(limit * 0.9)
+                    self.conn.execute("DELETE FROM %s WHERE path IN (SELECT path FROM %s ORDER BY %s LIMIT ?)"
+                                      % (table, table, order), (excess,))
+            except sqlite3.Error as e:
+                print("nemo-media-columns: cache trim failed: %s" % e)
+
+    def set_max_entries(self, max_entries):
+        self.max_entries = max_entries
+        self.trim()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+if __name__ == "__main__":
+    # Don't trim a cache the user made bigger than the default.
+    cache = MetadataCache(max_entries=sys.maxsize)
+
+    for path, error, cost, count, failed in cache.get_failures():
+        print("%3d  %6.2fs  %s  %s\n      %s" % (count, cost, time.strftime("%Y-%m-%d %H:%M", time.localtime(failed)),
+                                                path, error))
+
+    cache.close()
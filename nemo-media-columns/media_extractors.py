@@ -0,0 +1,550 @@
+#!/usr/bin/python3
+
+# Metadata extraction for nemo-media-columns.
+#
+# This runs in helper processes rather than inside Nemo, so a file that hangs
+# one of the parsing libraries (most of which are C code that can't be
+# interrupted) can simply be killed without taking the file manager with it.
+# Run as a script it serves requests over stdin/stdout, one JSON object per
+# line.
+#
+# The parsing libraries are imported by the extractors when they first need
+# them.  Together they take a couple of hundred ms to load (a process that
+# loads them all up front takes about 0.4 s to start, against 80 ms), which
+# would otherwise delay every new extractor process - including the ones
+# replacing a process killed on a timeout or cancel - and most processes only
+# ever see a few kinds of files (and the header readers handle most of those).
+# The extension is told when an import starts and ends, so it isn't counted
+# against the timeout of the file that needed it.
+
+import os
+import sys
+import json
+import importlib
+import gi
+from gi.repository import GLib, Gio
+
+import media_audio
+import media_image
+import media_pdf
+import media_source
+from media_info import FileExtensionInfo
+
+# Called with "loading" and then "loaded" around the imports, when serving.
+loading_listener = None
+
+class ExtractionFailed(Exception):
+    # Nothing could be read from the file.  Reported to the extension, which
+    # doesn't try the file again until it changes.
+    def __init__(self, errors):
+        Exception.__init__(self, "; ".join("%s: %s" % (type(e).__name__, e) for e in errors))
+
+class UnsupportedFile(Exception):
+    # No extractor handles the file's type.  The extension only sends files
+    # of the types the registry knows, so this means a caller got it wrong.
+    pass
+
+class Extractor():
+    # A handler for one family of formats.  mimetypes are matched with
+    # Gio.content_type_is_a, so subclasses of these types are handled too;
+    # attributes lists the FileExtensionInfo fields extract() can fill in.
+    name = None
+    mimetypes = ()
+    attributes = ()
+    # The parsing libraries extract() imports.
+    modules = ()
+    loaded = False
+
+    def load(self):
+        # Called by extract() before it first uses the parsing libraries.
+        if self.loaded:
+            return
+
+        self.loaded = True
+
+        if loading_listener is not None:
+            loading_listener("loading")
+
+        self.import_modules()
+
+        if loading_listener is not None:
+            loading_listener("loaded")
+
+    def import_modules(self):
+        # Missing libraries are left for extract() to report.
+        for module in self.modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+
+    def extract(self, source, wanted):
+        # source is the media_source.Source to read, which may not be a local
+        # file.  wanted is the set of attributes to fill in, only parts of
+        # the file needed for those should be read.  Raises ExtractionFailed
+        # if nothing at all could be read.
+        raise NotImplementedError()
+
+class Mp3Extractor(Extractor):
+    name = "mp3"
+    mimetypes = ('audio/mpeg',)
+    modules = ("mutagen.easyid3", "mutagen.id3", "mutagen.mp3")
+    tag_attributes = ("title", "album", "artist", "tracknumber", "genre", "date", "composer",
+                      "description")
+    stream_attributes = ("bitrate", "samplerate", "length")
+    attributes = tag_attributes + stream_attributes
+
+    def extract(self, source, wanted):
+        info = FileExtensionInfo()
+        # attempt to read ID3 tag
+        errors = []
+
+        want_tags = not wanted.isdisjoint(self.tag_attributes)
+        want_stream = not wanted.isdisjoint(self.stream_attributes)
+
+        # Most files can be read from their first and last few KB, mutagen
+        # is only needed for the rest.
+        fast = media_audio.read_mp3(source, tags=want_tags, stream=want_stream)
+
+        if fast is not None:
+            if want_tags:
+                self.set_tags(info, dict((key, [value]) for key, value in fast.items()))
+                want_tags = False
+            if want_stream:
+                self.set_stream(info, fast["bitrate"], fast["samplerate"], fast["length"])
+                want_stream = False
+
+        if want_tags or want_stream:
+            self.load()
+
+        if want_tags:
+            # for id3 support
+            from mutagen.easyid3 import EasyID3
+            from mutagen.id3 import ID3NoHeaderError
+
+            try:
+                with source.open() as f:
+                    self.set_tags(info, EasyID3(f))
+            except ID3NoHeaderError:
+                # untagged, nothing wrong with that
+                pass
+            except Exception as e:
+                errors.append(e)
+
+        if want_stream:
+            # try to read MP3 information (bitrate, length, samplerate)
+            try:
+                from mutagen.mp3 import MP3
+                with source.open() as mpfile:
+                    mpinfo = MP3(mpfile).info
+                    self.set_stream(info, mpinfo.bitrate, mpinfo.sample_rate, mpinfo.length)
+            except Exception as e:
+                errors.append(e)
+
+        # Only give up on the file if nothing could be read from it.
+        if errors and not info.to_dict():
+            raise ExtractionFailed(errors)
+
+        return info
+
+    def set_tags(self, info, audio):
+        # sometimes the audio variable will not have one of these items defined, that's why
+        # there is this long try / except attempt
+        try: info.title = audio["title"][0]
+        except: pass
+        try: info.album = audio["album"][0]
+        except: pass
+        try: info.artist = audio["artist"][0]
+        except: pass
+        try: info.tracknumber = "{:0>2}".format(audio["tracknumber"][0])
+        except: pass
+        try: info.genre = audio["genre"][0]
+        except: pass
+        try: info.date = audio["date"][0]
+        except: pass
+        try: info.composer = audio["composer"][0]
+        except: pass
+        try: info.description = audio["version"][0]
+        except: pass
+
+    def set_stream(self, info, bitrate, samplerate, length):
+        info.bitrate = int(bitrate)
+        info.samplerate = int(samplerate)
+        info.length = length
+
+class ImageExtractor(Extractor):
+    name = "image"
+    mimetypes = ('image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff', 'image/webp')
+    modules = ("PIL.Image",)
+    exif_attributes = ("exif_datetime_original", "exif_software", "exif_flash", "exif_rating")
+    attributes = exif_attributes + ("pixeldimensions",)
+
+    def import_modules(self):
+        Extractor.import_modules(self)
+
+        try:
+            gi.require_version('GExiv2', '0.10')
+            from gi.repository import GExiv2
+        except (ImportError, ValueError):
+            pass
+
+    def extract(self, source, wanted):
+        info = FileExtensionInfo()
+        # EXIF handling routines
+        errors = []
+
+        want_exif = not wanted.isdisjoint(self.exif_attributes)
+        want_size = "pixeldimensions" in wanted
+
+        # Settles most files from their first few KB, GExiv2 and PIL are only
+        # needed for what it couldn't.
+        fast = media_image.read_image(source, exif=want_exif, dimensions=want_size)
+
+        if all(attribute in fast for attribute in self.exif_attributes):
+            for attribute in self.exif_attributes:
+                setattr(info, attribute, fast[attribute])
+            want_exif = False
+
+        if "pixeldimensions" in fast:
+            info.width, info.height = fast["pixeldimensions"]
+            want_size = False
+
+        if want_exif or want_size:
+            self.load()
+
+        # GExiv2 can only open local files.
+        if want_exif and source.path is not None:
+            try:
+                gi.require_version('GExiv2', '0.10')
+                from gi.repository import GExiv2
+                metadata = GExiv2.Metadata(path=source.path)
+
+                try:
+                    info.exif_datetime_original = str(metadata.get_date_time())
+                except:
+                    pass
+
+                info.exif_software = metadata.get('Exif.Image.Software', None)
+                info.exif_flash = metadata.get('Exif.Photo.Flash', None)
+                info.exif_rating = metadata.get('Xmp.xmp.Rating', None)
+            except (GLib.Error, ImportError, ValueError) as e:
+                errors.append(e)
+
+        if want_size:
+            # try read image info directly
+            try:
+                # for reading image dimensions
+                import PIL.Image
+                with source.open() as f, PIL.Image.open(f) as im:
+                    info.width, info.height = im.size
+            except Exception as e:
+                errors.append(e)
+
+        if errors and not info.to_dict():
+            raise ExtractionFailed(errors)
+
+        return info
+
+# video/flac handling
+
+# The MediaInfo fields behind each attribute, by track type.  Only these are
+# asked for, through an Inform template, rather than having MediaInfo dump
+# every field it knows as XML for pymediainfo to turn into dicts.
+MEDIAINFO_FIELDS = {
+    "General": (("length", "Duration"), ("bitrate", "OverallBitRate"), ("title", "Track"),
+                ("artist", "Performer"), ("tracknumber", "Track/Position"), ("date", "Recorded_Date"),
+                ("album", "Album"), ("genre", "Genre"), ("description", "Description"),
+                ("composer", "Composer")),
+    "Video": (("pixeldimensions", "Width"), ("pixeldimensions", "Height"), ("length", "Duration")),
+    "Audio": (("samplerate", "SamplingRate"), ("length", "Duration")),
+}
+
+# Separate the fields and the tracks of the template output.
+FIELD_SEPARATOR = "\x1f"
+TRACK_SEPARATOR = "\x1e"
+
+# Tags and stream headers are at the start of the file.  Only durations and
+# bitrates can need a look further in (MPEG-PS/TS, VBR audio), so MediaInfo's
+# default is kept for those.
+FAST_PARSE_SPEED = 0.0
+DURATION_PARSE_SPEED = 0.5
+
+class MediaInfoExtractor(Extractor):
+    name = "mediainfo"
+    mimetypes = ('video/x-msvideo', 'video/mpeg', 'video/x-ms-wmv', 'video/mp4',
+                 'video/x-flv', 'video/x-matroska', 'audio/x-wav',
+                 'audio/m4a', 'audio/mp4', 'audio/ogg')
+    attributes = ("pixeldimensions", "samplerate", "bitrate", "length", "title", "artist",
+                  "genre", "tracknumber", "date", "album", "description", "composer")
+
+    def import_modules(self):
+        # libmediainfo itself is only loaded on first use.
+        try:
+            from pymediainfo import MediaInfo
+            MediaInfo.can_parse()
+        except (ImportError, OSError):
+            pass
+
+    def get_template(self, wanted):
+        # Returns the Inform template for the wanted attributes, and the
+        # MediaInfo fields it gives for each track type.
+        sections = []
+        fields = {}
+
+        for track_type, track_fields in MEDIAINFO_FIELDS.items():
+            names = [field for attribute, field in track_fields if attribute in wanted]
+
+            if names:
+                fields[track_type] = names
+                sections.append("%s;%s%s%s" % (track_type, track_type,
+                                               "".join(FIELD_SEPARATOR + "%" + name + "%" for name in names),
+                                               TRACK_SEPARATOR))
+
+        return "\n".join(sections), fields
+
+    def extract(self, source, wanted):
+        info = FileExtensionInfo()
+        template, fields = self.get_template(wanted)
+        parse_speed = DURATION_PARSE_SPEED if not wanted.isdisjoint(("length", "bitrate")) else FAST_PARSE_SPEED
+
+        self.load()
+
+        try:
+            # for reading videos. for future improvement, this can also read mp3!
+            from pymediainfo import MediaInfo
+
+            if source.path is not None:
+                output = MediaInfo.parse(source.path, output=template, parse_speed=parse_speed, full=False)
+            else:
+                # MediaInfo seeks around the stream itself.
+                with source.open() as f:
+                    output = MediaInfo.parse(f, output=template, parse_speed=parse_speed, full=False)
+
+            tracks = []
+
+            for record in output.split(TRACK_SEPARATOR):
+                values = record.strip("\r\n").split(FIELD_SEPARATOR)
+
+                if values == [""]:
+                    continue
+
+                if values[0] not in fields or len(values) != len(fields[values[0]]) + 1:
+                    raise ValueError("unexpected MediaInfo output %r" % record)
+
+                tracks.append((values[0], dict((name, value or None)
+                                               for name, value in zip(fields[values[0]], values[1:]))))
+
+            # The last video track's duration, or the container's, or the
+            # first audio track's.
+            video_duration = general_duration = audio_duration = 0
+
+            for track_type, track in tracks:
+                if track_type == "Video":
+                    try:
+                        info.width, info.height = int(track["Width"]), int(track["Height"])
+                    except:
+                        pass
+
+                    try:
+                        video_duration = int(float(track['Duration']))
+                    except:
+                        pass
+
+                if track_type == "Audio":
+                    try:
+                        info.samplerate = int(float(track['SamplingRate']))
+                    except:
+                        pass
+                    try:
+                        if audio_duration == 0:
+                            audio_duration = int(float(track['Duration']))
+                    except:
+                        pass
+
+                if track_type == "General":
+                    try:
+                        info.bitrate = int(float(track['OverallBitRate']))
+                    except:
+                        pass
+                    try:
+                        general_duration = int(float(track['Duration']))
+                    except:
+                        pass
+
+                    for attribute, field in MEDIAINFO_FIELDS["General"][2:]:
+                        if field in track:
+                            setattr(info, attribute, track[field])
+
+            duration = video_duration or general_duration or audio_duration
+
+            if duration > 0:
+                info.length = duration / 1000 # ms to s
+        except Exception as e:
+            raise ExtractionFailed([e])
+
+        return info
+
+class FlacExtractor(Extractor):
+    # Reads the metadata blocks directly, falling back to MediaInfo for
+    # anything unusual.
+    name = "flac"
+    mimetypes = ('audio/x-flac', 'audio/flac')
+    tag_attributes = ("title", "artist", "genre", "tracknumber", "date", "album", "description",
+                      "composer")
+    attributes = tag_attributes + ("samplerate", "bitrate", "length")
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def extract(self, source, wanted):
+        fast = media_audio.read_flac(source, tags=not wanted.isdisjoint(self.tag_attributes))
+
+        if fast is None:
+            return self.fallback.extract(source, wanted)
+
+        info = FileExtensionInfo()
+
+        for attribute in self.tag_attributes:
+            setattr(info, attribute, fast.get(attribute))
+
+        info.samplerate = fast["samplerate"]
+        info.bitrate = fast["bitrate"]
+        info.length = fast["length"]
+
+        return info
+
+class PdfExtractor(Extractor):
+    name = "pdf"
+    mimetypes = ('application/pdf',)
+    modules = ("pypdf",)
+    attributes = ("title", "artist", "pages")
+
+    def extract(self, source, wanted):
+        info = FileExtensionInfo()
+
+        # Goes straight to the page count and the document info, pypdf is
+        # only needed for files it can't make sense of (or encrypted ones).
+        fast = media_pdf.read_pdf(source, info=not wanted.isdisjoint(("title", "artist")),
+                                  pages="pages" in wanted)
+
+        if fast is not None:
+            for field in wanted.intersection(fast):
+                setattr(info, field, fast[field])
+            return info
+
+        self.load()
+
+        try:
+            # for reading pdf
+            from pypdf import PdfReader
+            with source.open() as f:
+                pdf = PdfReader(f)
+                # Most encrypted files only have an owner password, which
+                # doesn't stop us from reading them.
+                if pdf.is_encrypted and not pdf.decrypt(""):
+                    raise ValueError("encrypted with a user password")
+                # len(pdf.pages) walks the whole page tree, only do it when needed.
+                if "title" in wanted:
+                    try: info.title = pdf.metadata.title
+                    except: pass
+                if "artist" in wanted:
+                    try: info.artist = pdf.metadata.author
+                    except: pass
+                if "pages" in wanted:
+                    try: info.pages = len(pdf.pages)
+                    except: pass
+        except Exception as e:
+            raise ExtractionFailed([e])
+
+        return info
+
+class ExtractorRegistry():
+    # Maps mime types to extractors.  Each distinct mime type is only checked
+    # against the registered types once, after that it's a dict lookup.
+    def __init__(self, extractors=()):
+        self.extractors = []
+        self.by_name = {}
+        self.resolved = {}
+
+        for extractor in extractors:
+            self.register(extractor)
+
+    def register(self, extractor):
+        self.extractors.append(extractor)
+        self.by_name[extractor.name] = extractor
+        self.resolved = {}
+
+    def lookup(self, mimetype):
+        try:
+            return self.resolved[mimetype]
+        except KeyError:
+            pass
+
+        match = None
+
+        for extractor in self.extractors:
+            if any(Gio.content_type_is_a(mimetype, t) for t in extractor.mimetypes):
+                match = extractor
+                break
+
+        self.resolved[mimetype] = match
+
+        return match
+
+mediainfo_extractor = MediaInfoExtractor()
+
+registry = ExtractorRegistry((Mp3Extractor(), FlacExtractor(mediainfo_extractor), ImageExtractor(),
+                              mediainfo_extractor, PdfExtractor()))
+
+def get_media_info(location, mimetype, wanted=None):
+    # location is a local path or, for files that aren't local, a URI.
+    # Raises UnsupportedFile if no extractor handles mimetype.
+    extractor = registry.lookup(mimetype)
+
+    if extractor is None:
+        raise UnsupportedFile("no extractor handles %s files" % mimetype)
+
+    wanted = frozenset(extractor.attributes if wanted is None else wanted)
+
+    # Nothing this extractor provides is being displayed.
+    if wanted.isdisjoint(extractor.attributes):
+        return FileExtensionInfo()
+
+    with media_source.open_source(location) as source:
+        return extractor.extract(source, wanted)
+
+def serve():
+    # Keep the protocol stream to ourselves - anything the libraries print
+    # goes to stderr instead.
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # Don't compete with the file manager for the cpu.
+    os.nice(10)
+
+    def send_progress(message):
+        replies.write(json.dumps({"progress": message}) + "\n")
+        replies.flush()
+
+    global loading_listener
+    loading_listener = send_progress
+
+    replies.write("ready\n")
+    replies.flush()
+
+    for line in sys.stdin:
+        request = json.loads(line)
+
+        try:
+            info = get_media_info(request["path"], request["mimetype"], request.get("attributes"))
+            reply = {"info": info.to_dict()}
+        except (ExtractionFailed, UnsupportedFile) as e:
+            reply = {"error": str(e)}
+        except Exception as e:
+            reply = {"error": "%s: %s" % (type(e).__name__, e)}
+
+        replies.write(json.dumps(reply, default=str) + "\n")
+        replies.flush()
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+
+# Fast header reader for JPEG, PNG, GIF and TIFF images.
+#
+# The pixel dimensions and the few EXIF/XMP tags the columns show are stored
+# ahead of the image data, so a single read of the first few KB of the file
+# usually has all of them.  Anything stored further in (a TIFF whose IFD sits
+# at the end of the file, a JPEG with large APP segments) is fetched with
+# small reads of just that part.  Attributes that can't be settled this way
+# are left out of the result, and the caller asks GExiv2 or PIL instead.
+
+import re
+import struct
+from datetime import datetime
+
+HEAD_SIZE = 64 * 1024
+MAX_SEGMENT_SIZE = 256 * 1024
+
+EXIF_ATTRIBUTES = ("exif_datetime_original", "exif_software", "exif_flash", "exif_rating")
+
+# TIFF tags
+TAG_WIDTH = 0x0100
+TAG_HEIGHT = 0x0101
+TAG_DATETIME = 0x0132
+TAG_SOFTWARE = 0x0131
+TAG_XMP = 0x02bc
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_FLASH = 0x9209
+
+# TIFF field types we need, and their sizes.
+TIFF_TYPES = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1, 9: 4}
+
+MAX_IFD_ENTRIES = 1000
+
+# JPEG start-of-frame markers - C4, C8 and CC are something else.
+JPEG_SOF = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+
+XMP_RATING = re.compile(rb"""xmp:Rating\s*=\s*["']([^"']*)["']|<xmp:Rating>([^<]*)<""")
+
+class HeaderError(Exception):
+    pass
+
+class Reader():
+    # Reads from the file, served from the head where it covers the range.
+    def __init__(self, source):
+        self.source = source
+        self.size = source.size
+        self.head = source.pread(HEAD_SIZE, 0)
+
+    def read(self, offset, length):
+        if offset + length <= len(self.head):
+            return self.head[offset:offset + length]
+
+        if length > MAX_SEGMENT_SIZE:
+            raise HeaderError("oversized read")
+
+        data = self.source.pread(length, offset)
+
+        if len(data) < length:
+            raise HeaderError("truncated file")
+
+        return data
+
+class Tiff():
+    # A TIFF structure, in a file of its own or in a JPEG's Exif segment.
+    # read(offset, length) reads relative to the TIFF header.
+    def __init__(self, read):
+        self.read = read
+        header = read(0, 8)
+
+        if header[:4] == b"II*\x00":
+            self.order = "<"
+        elif header[:4] == b"MM\x00*":
+            self.order = ">"
+        else:
+            raise HeaderError("bad TIFF header")
+
+        self.first_ifd = self.unpack("I", header[4:8])
+
+    def unpack(self, fmt, data):
+        return struct.unpack(self.order + fmt, data)[0]
+
+    def read_ifd(self, offset, wanted):
+        # Returns {tag: value} for the wanted tags of the IFD at offset.
+        count = self.unpack("H", self.read(offset, 2))
+
+        if count > MAX_IFD_ENTRIES:
+            raise HeaderError("bad IFD")
+
+        entries = self.read(offset + 2, count * 12)
+        values = {}
+
+        for i in range(count):
+            entry = entries[i * 12:i * 12 + 12]
+            tag = self.unpack("H", entry[:2])
+
+            if tag not in wanted:
+                continue
+
+            field_type = self.unpack("H", entry[2:4])
+            field_count = self.unpack("I", entry[4:8])
+
+            if field_type not in TIFF_TYPES:
+                raise HeaderError("unexpected type %d for tag 0x%04x" % (field_type, tag))
+
+            size = TIFF_TYPES[field_type] * field_count
+
+            if size <= 4:
+                data = entry[8:8 + size]
+            else:
+                data = self.read(self.unpack("I", entry[8:12]), size)
+
+            if field_type in (1, 7):
+                values[tag] = data
+            elif field_type == 2:
+                values[tag] = data.split(b"\x00")[0].decode("utf-8", "replace")
+            elif field_type == 3:
+                values[tag] = self.unpack("H", data[:2])
+            else:
+                values[tag] = self.unpack("I", data[:4])
+
+        return values
+
+    def read_exif(self, values, exif=True, dimensions=False):
+        # Fills in the EXIF attributes and the size of the first image, and
+        # returns the XMP packet, if any.
+        wanted = set()
+
+        if exif:
+            wanted |= {TAG_SOFTWARE, TAG_DATETIME, TAG_EXIF_IFD, TAG_XMP}
+        if dimensions:
+            wanted |= {TAG_WIDTH, TAG_HEIGHT}
+
+        ifd0 = self.read_ifd(self.first_ifd, wanted)
+
+        if dimensions and TAG_WIDTH in ifd0 and TAG_HEIGHT in ifd0:
+            values["pixeldimensions"] = (ifd0[TAG_WIDTH], ifd0[TAG_HEIGHT])
+
+        if not exif:
+            return None
+
+        exif_ifd = {}
+
+        if TAG_EXIF_IFD in ifd0:
+            exif_ifd = self.read_ifd(ifd0[TAG_EXIF_IFD], {TAG_DATETIME_ORIGINAL, TAG_FLASH})
+
+        values["exif_software"] = ifd0.get(TAG_SOFTWARE)
+        values["exif_flash"] = str(exif_ifd[TAG_FLASH]) if TAG_FLASH in exif_ifd else None
+        values["exif_datetime_original"] = format_date(exif_ifd.get(TAG_DATETIME_ORIGINAL) or
+                                                       ifd0.get(TAG_DATETIME))
+
+        return ifd0.get(TAG_XMP)
+
+def block_reader(block):
+    # For a TIFF structure embedded in another format.
+    def read(offset, length):
+        if offset + length > len(block):
+            raise HeaderError("TIFF data runs past its block")
+        return block[offset:offset + length]
+
+    return read
+
+def format_date(value):
+    # The way GExiv2's get_date_time() comes out of str().
+    if not value:
+        return None
+
+    try:
+        return str(datetime.strptime(value.strip(), "%Y:%m:%d %H:%M:%S"))
+    except ValueError:
+        return None
+
+def parse_xmp_rating(packet):
+    if packet is None:
+        return None
+
+    match = XMP_RATING.search(packet)
+
+    if match is None:
+        # Some other spelling we'd rather leave to GExiv2.
+        if b"Rating" in packet:
+            raise HeaderError("unrecognised XMP rating")
+        return None
+
+    return (match.group(1) or match.group(2)).decode("utf-8", "replace").strip() or None
+
+def read_jpeg(reader, values, exif, dimensions):
+    pos = 2
+    xmp = None
+    found_exif = False
+
+    while True:
+        marker = reader.read(pos, 4)
+
+        if marker[0] != 0xff:
+            raise HeaderError("lost sync at %d" % pos)
+
+        # Fill bytes
+        if marker[1] == 0xff:
+            pos += 1
+            continue
+
+        code = marker[1]
+
+        if code in (0x01,) or 0xd0 <= code <= 0xd7:
+            pos += 2
+            continue
+
+        if code in (0xd9, 0xda):
+            # End of image or start of scan - no more metadata to come.
+            raise HeaderError("no frame header")
+
+        length = struct.unpack(">H", marker[2:4])[0]
+        start = pos + 4
+        pos += 2 + length
+
+        if code in JPEG_SOF:
+            frame = reader.read(start, 5)
+            height, width = struct.unpack(">HH", frame[1:5])
+            if dimensions:
+                values["pixeldimensions"] = (width, height)
+            break
+
+        if code != 0xe1 or not exif:
+            continue
+
+        prefix = reader.read(start, min(len(XMP_HEADER), length - 2))
+
+        if prefix.startswith(EXIF_HEADER) and not found_exif:
+            found_exif = True
+            segment = reader.read(start + len(EXIF_HEADER), length - 2 - len(EXIF_HEADER))
+            Tiff(block_reader(segment)).read_exif(values)
+        elif prefix == XMP_HEADER:
+            xmp = reader.read(start + len(XMP_HEADER), length - 2 - len(XMP_HEADER))
+
+    if exif:
+        # All of the metadata segments come before the frame header.
+        if not found_exif:
+            values.update(dict.fromkeys(EXIF_ATTRIBUTES[:3]))
+        values["exif_rating"] = parse_xmp_rating(xmp)
+
+def read_png(reader, values, exif, dimensions):
+    header = reader.read(8, 25)
+
+    if header[4:8] != b"IHDR":
+        raise HeaderError("no IHDR chunk")
+
+    if dimensions:
+        values["pixeldimensions"] = struct.unpack(">II", header[8:16])
+
+    if not exif:
+        return
+
+    pos = 8
+    xmp = None
+    found_exif = False
+
+    # Metadata chunks have to come before the image data.
+    while True:
+        chunk = reader.read(pos, 8)
+        length = struct.unpack(">I", chunk[:4])[0]
+        chunk_type = chunk[4:8]
+        start = pos + 8
+        pos = start + length + 4
+
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+
+        if chunk_type == b"eXIf" and not found_exif:
+            found_exif = True
+            Tiff(block_reader(reader.read(start, length))).read_exif(values)
+        elif chunk_type in (b"iTXt", b"tEXt", b"zTXt"):
+            keyword = reader.read(start, min(length, 80)).split(b"\x00")[0]
+
+            if keyword == b"XML:com.adobe.xmp" and chunk_type == b"iTXt":
+                data = reader.read(start, length)
+                # keyword, null, compression flag, method, language, null,
+                # translated keyword, null, text
+                fields = data.split(b"\x00", 1)[1]
+                if fields[0] != 0:
+                    raise HeaderError("compressed XMP")
+                xmp = fields[2:].split(b"\x00", 2)[2]
+            elif keyword.startswith(b"Raw profile type"):
+                # ImageMagick's hex-encoded profiles, which GExiv2 reads too.
+                raise HeaderError("raw profile chunk")
+
+    if not found_exif:
+        values.update(dict.fromkeys(EXIF_ATTRIBUTES[:3]))
+    values["exif_rating"] = parse_xmp_rating(xmp)
+
+def read_gif(reader, values, exif, dimensions):
+    if dimensions:
+        values["pixeldimensions"] = struct.unpack("<HH", reader.read(6, 4))
+
+    # GExiv2 doesn't read any metadata from GIFs.
+    if exif:
+        values.update(dict.fromkeys(EXIF_ATTRIBUTES))
+
+def read_tiff(reader, values, exif, dimensions):
+    xmp = Tiff(reader.read).read_exif(values, exif, dimensions)
+
+    if exif:
+        values["exif_rating"] = parse_xmp_rating(xmp)
+
+def read_image(source, exif=True, dimensions=True):
+    # Returns a dict with the EXIF_ATTRIBUTES, if exif is set, and
+    # "pixeldimensions" as (width, height), if dimensions is set.  An
+    # attribute with a value of None is known not to be there; attributes
+    # that are missing from the dict need a closer look.  source is a
+    # media_source.Source.
+    values = {}
+
+    try:
+        reader = Reader(source)
+        magic = reader.head[:8]
+
+        if magic.startswith(b"\xff\xd8"):
+            read_jpeg(reader, values, exif, dimensions)
+        elif magic == b"\x89PNG\r\n\x1a\n":
+            read_png(reader, values, exif, dimensions)
+        elif magic[:6] in (b"GIF87a", b"GIF89a"):
+            read_gif(reader, values, exif, dimensions)
+        elif magic[:4] in (b"II*\x00", b"MM\x00*"):
+            read_tiff(reader, values, exif, dimensions)
+    except (HeaderError, IndexError, struct.error, OSError):
+        # Keep whatever was settled before things went wrong, only if all of
+        # the EXIF attributes made it - they're read as a group.
+        if not all(attribute in values for attribute in EXIF_ATTRIBUTES):
+            for attribute in EXIF_ATTRIBUTES:
+                values.pop(attribute, None)
+
+    return values
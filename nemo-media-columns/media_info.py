@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# The metadata nemo-media-columns knows about for a single file.  Shared by the
+# extension and its extractor processes, so keep this free of heavy imports.
+#
+# Numbers are kept as numbers (bits/s, Hz, seconds, pixels, pages) and only
+# turned into column text by format_attribute(), so that the text can be
+# padded to sort correctly and stays the same whichever parser the value
+# came from.
+
+# The attributes of our columns, in column order.
+ATTRIBUTES = ("title", "album", "artist", "tracknumber", "genre", "date",
+              "bitrate", "pages", "samplerate", "length", "composer", "description",
+              "exif_datetime_original", "exif_software", "exif_flash",
+              "exif_pixeldimensions", "exif_rating", "pixeldimensions")
+
+TEXT_FIELDS = ("title", "album", "artist", "tracknumber", "genre", "date", "composer",
+               "description", "exif_datetime_original", "exif_software", "exif_flash",
+               "exif_rating")
+NUMBER_FIELDS = ("bitrate", "samplerate", "length", "pages", "width", "height",
+                 "exif_width", "exif_height")
+FIELDS = TEXT_FIELDS + NUMBER_FIELDS
+
+# Attributes that are made up of several fields.
+COMPOUND_ATTRIBUTES = {
+    "pixeldimensions": ("width", "height"),
+    "exif_pixeldimensions": ("exif_width", "exif_height"),
+}
+
+class FileExtensionInfo():
+    __slots__ = FIELDS
+
+    def __init__(self, fields=None):
+        for field in FIELDS:
+            setattr(self, field, None)
+
+        if fields:
+            for field, value in fields.items():
+                setattr(self, field, value)
+
+    def to_dict(self):
+        # Only the fields that are set.
+        return dict((field, getattr(self, field)) for field in FIELDS if getattr(self, field) is not None)
+
+def get_fields(attributes):
+    # The fields that hold the given attributes.
+    fields = []
+
+    for attribute in attributes:
+        fields.extend(COMPOUND_ATTRIBUTES.get(attribute, (attribute,)))
+
+    return fields
+
+def format_length(seconds):
+    seconds = int(seconds)
+    return "%02i:%02i:%02i" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def format_dimensions(width, height):
+    if width is None or height is None:
+        return None
+    return "%05dx%05d" % (width, height)
+
+def format_attribute(info, attribute):
+    # The column text for an attribute, zero-padded where it's a number so
+    # that Nemo's plain string sort puts it in order.
+    if attribute == "pixeldimensions":
+        return format_dimensions(info.width, info.height)
+    if attribute == "exif_pixeldimensions":
+        return format_dimensions(info.exif_width, info.exif_height)
+
+    value = getattr(info, attribute)
+
+    if value is None:
+        return None
+    if attribute == "bitrate":
+        return "%05d kbps" % round(value / 1000)
+    if attribute == "samplerate":
+        return "%06d Hz" % value
+    if attribute == "length":
+        return format_length(value)
+
+    return str(value)
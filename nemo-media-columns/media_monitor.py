@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# Watches the directories nemo-media-columns has filled in, so cached values
+# of files that change are dropped as soon as it happens.  The cache checks
+# each file's size and mtime anyway, but that misses tag editors that keep
+# the original mtime, and this way a retagged album only costs a parse of
+# the files that were actually written.
+#
+# Every monitor takes an inotify watch, which are a limited resource, so only
+# the most recently used directories are watched.
+
+from collections import OrderedDict
+
+from gi.repository import GLib, Gio
+
+MAX_DIRECTORIES = 64
+
+# Events after which a file's contents may be different, or gone.
+CHANGE_EVENTS = (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                 Gio.FileMonitorEvent.DELETED,
+                 Gio.FileMonitorEvent.MOVED_OUT,
+                 Gio.FileMonitorEvent.MOVED_IN,
+                 Gio.FileMonitorEvent.RENAMED)
+
+class DirectoryMonitors():
+    # on_changed(path) is called on the main loop for every file that
+    # changed in one of the watched directories.
+    def __init__(self, on_changed, max_directories=MAX_DIRECTORIES):
+        self.on_changed = on_changed
+        self.max_directories = max_directories
+        # dir uri -> Gio.FileMonitor, least recently used first
+        self.monitors = OrderedDict()
+
+    def watch(self, directory):
+        # Main loop only.  directory is a Gio.File.
+        uri = directory.get_uri()
+        monitor = self.monitors.pop(uri, None)
+
+        if monitor is None:
+            try:
+                monitor = directory.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error as e:
+                print("nemo-media-columns: could not watch '%s': %s" % (uri, e))
+                return
+
+            monitor.connect("changed", self.on_monitor_changed)
+
+        self.monitors[uri] = monitor
+
+        while len(self.monitors) > self.max_directories:
+            self.monitors.popitem(last=False)[1].cancel()
+
+    def on_monitor_changed(self, monitor, file, other_file, event_type):
+        if event_type not in CHANGE_EVENTS:
+            return
+
+        # For renames, the new name may have replaced another file.
+        for changed in (file, other_file):
+            if changed is not None and changed.get_path() is not None:
+                self.on_changed(changed.get_path())
+
+    def clear(self):
+        for monitor in self.monitors.values():
+            monitor.cancel()
+
+        self.monitors.clear()
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+# Keeps nemo-media-columns from flooding slow filesystems.
+#
+# Each file is matched to the mount it lives on, using /proc/self/mounts.
+# Network and FUSE filesystems are "remote": extractions on each of them are
+# limited in number and in how many bytes a second they may read, and can be
+# switched off entirely in favour of what's already in the cache.
+#
+# Paths are matched as they are, not resolved - resolving symlinks would
+# itself mean a round trip to the server for every file.  Files that aren't
+# local are given by URI, and each server counts as a remote mount.
+
+import re
+import time
+import threading
+
+from media_workers import JobDeferred
+
+MOUNTS_FILE = "/proc/self/mounts"
+
+# How long the mount table is trusted before reading it again (seconds).
+MOUNTS_TTL = 10.0
+
+REMOTE_TYPES = frozenset(("nfs", "nfs4", "cifs", "smb3", "smbfs", "ncpfs", "9p", "afs",
+                          "ceph", "glusterfs", "lustre", "davfs", "coda"))
+
+# FUSE filesystems are usually network ones (sshfs, gvfs, rclone...), apart
+# from these.  Block device backed ones (ntfs-3g, exfat) are "fuseblk".
+LOCAL_FUSE_TYPES = frozenset(("fuse.portal", "fuse.lxcfs", "fuse.appimagefs"))
+
+class Mount():
+    def __init__(self, mount_point, fs_type):
+        self.mount_point = mount_point
+        self.fs_type = fs_type
+        self.remote = (fs_type in REMOTE_TYPES or fs_type.startswith("gvfs.") or
+                       (fs_type.startswith("fuse.") and fs_type not in LOCAL_FUSE_TYPES))
+
+ROOT = Mount("/", "unknown")
+
+def unescape(field):
+    # Spaces and such are given as octal escapes.
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), field)
+
+class MountTable():
+    def __init__(self, path=MOUNTS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mounts = []
+        self.loaded = None
+
+    def load(self):
+        mounts = {}
+
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        # Later mounts hide earlier ones on the same mount point.
+                        mount = Mount(unescape(fields[1]), fields[2])
+                        mounts[mount.mount_point] = mount
+        except OSError as e:
+            print("nemo-media-columns: could not read the mount table: %s" % e)
+
+        # Longest first, so the first match is the innermost mount.
+        return sorted(mounts.values(), key=lambda mount: len(mount.mount_point), reverse=True)
+
+    def lookup(self, path):
+        # Any thread.  Returns the Mount path is on.
+        if not path.startswith("/"):
+            scheme, _, rest = path.partition("://")
+            return Mount("%s://%s/" % (scheme, rest.split("/", 1)[0]), "gvfs." + scheme)
+
+        with self.lock:
+            now = time.monotonic()
+
+            if self.loaded is None or now - self.loaded > MOUNTS_TTL:
+                self.mounts = self.load()
+                self.loaded = now
+
+            mounts = self.mounts
+
+        for mount in mounts:
+            prefix = mount.mount_point.rstrip("/") + "/"
+            if path == mount.mount_point or path.startswith(prefix):
+                return mount
+
+        return ROOT
+
+class MountBudget():
+    # The extractions running on one mount, and the bytes they've read
+    # beyond the mount's rate.
+    def __init__(self):
+        self.running = 0
+        self.debt = 0.0
+        self.updated = time.monotonic()
+
+class Ticket():
+    # One extraction's hold on a mount's budget.  size is charged if the
+    # extractor can't tell how much it actually read.
+    def __init__(self, budget, size, mount_point):
+        self.budget = budget
+        self.size = size
+        self.mount_point = mount_point
+        self.bytes_read = None
+
+    def charge(self, bytes_read):
+        self.bytes_read = bytes_read
+
+class MountLimiter():
+    # Per mount limits for remote filesystems: at most `workers` extractions
+    # at once, and on average at most `rate` bytes read a second (0 for no
+    # limit).  Shared by all of the worker threads.
+    #
+    # Nothing waits here: an extraction that can't start raises JobDeferred,
+    # giving its worker back to the files on other mounts, and wake(mount
+    # point, delay) is called when one may start again.
+    def __init__(self, workers=1, rate=0, wake=None):
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.rate = rate
+        self.wake = wake
+        self.budgets = {}
+
+    def configure(self, workers, rate):
+        with self.lock:
+            self.workers = max(1, workers)
+            self.rate = max(0, rate)
+
+        if self.wake is not None:
+            self.wake(None)
+
+    def _pay_off(self, budget, now):
+        if self.rate:
+            budget.debt = max(0.0, budget.debt - self.rate * (now - budget.updated))
+        else:
+            budget.debt = 0.0
+
+        budget.updated = now
+
+    def acquire(self, mount, size):
+        # Returns a Ticket if an extraction on mount may start now, raises
+        # JobDeferred (keyed by the mount point) if not.
+        with self.lock:
+            budget = self.budgets.get(mount.mount_point)
+
+            if budget is None:
+                budget = self.budgets[mount.mount_point] = MountBudget()
+
+            self._pay_off(budget, time.monotonic())
+
+            if budget.running >= self.workers:
+                # Until release() wakes it.
+                raise JobDeferred(mount.mount_point)
+
+            if budget.debt > 0:
+                raise JobDeferred(mount.mount_point, budget.debt / self.rate)
+
+            budget.running += 1
+
+        return Ticket(budget, size, mount.mount_point)
+
+    def release(self, ticket):
+        with self.lock:
+            budget = ticket.budget
+            self._pay_off(budget, time.monotonic())
+
+            budget.running -= 1
+            budget.debt += ticket.size if ticket.bytes_read is None else ticket.bytes_read
+
+        # With a rate, the next one is let in once the debt is paid off.
+        if self.wake is not None:
+            self.wake(ticket.mount_point, budget.debt / self.rate if self.rate else 0)
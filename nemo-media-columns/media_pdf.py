@@ -0,0 +1,743 @@
+#!/usr/bin/python3
+
+# Fast reader for the page count, title and author of a PDF.
+#
+# pypdf builds the whole page tree to count the pages, which takes seconds
+# and a lot of memory on documents with thousands of them.  All we need is
+# the /Count of the root of the page tree and the /Info dictionary, which a
+# handful of small reads can get to: the trailer at the end of the file
+# points at the cross-reference sections (tables or streams, following the
+# /Prev chain of incremental updates), and those at the few objects we want,
+# possibly inside compressed object streams.
+#
+# Nothing else is parsed, and nothing is read that isn't needed.  Anything
+# unexpected - a damaged cross-reference, an encrypted file, a filter we
+# don't decode - gives up, and the caller uses pypdf instead.
+
+import re
+import zlib
+
+# Where to look for "startxref".
+TAIL_SIZE = 4096
+
+# How much of an object to read at first, and at most.
+OBJECT_CHUNK = 4096
+MAX_OBJECT_SIZE = 256 * 1024
+
+# Cross-reference and object streams, compressed and decoded.
+MAX_STREAM_SIZE = 4 * 1024 * 1024
+MAX_DECODED_SIZE = 16 * 1024 * 1024
+
+MAX_SECTIONS = 64
+MAX_DEPTH = 32
+
+WHITESPACE = b"\x00\t\n\x0c\r "
+DELIMITERS = b"()<>[]{}/%"
+
+NUMBER = re.compile(rb"[+-]?(\d+\.?\d*|\.\d+)")
+REFERENCE = re.compile(rb"\s+(\d+)\s+R(?=[\x00\t\n\x0c\r ()<>\[\]{}/%]|$)")
+OBJECT_HEADER = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj(?=[\x00\t\n\x0c\r ()<>\[\]{}/%])")
+XREF_ENTRY = re.compile(rb"(\d{10}) (\d{5}) ([nf])[\r\n ]{2}")
+SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*(\r\n|\r|\n)")
+
+ESCAPES = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("f"): b"\f",
+           ord("("): b"(", ord(")"): b")", ord("\\"): b"\\"}
+
+# PDFDocEncoding matches Latin-1 for these.  Text with anything else in it is
+# left to pypdf.
+PDFDOC_LATIN1 = frozenset(b"\t\n\r" + bytes(range(0x20, 0x7f)) + bytes(range(0xa1, 0xad)) +
+                          bytes(range(0xae, 0x100)))
+
+class PdfError(Exception):
+    pass
+
+class NeedMore(Exception):
+    # The object runs past the data that was read.
+    pass
+
+class Name(str):
+    pass
+
+class Reference():
+    __slots__ = ("number", "generation")
+
+    def __init__(self, number, generation):
+        self.number = number
+        self.generation = generation
+
+class Stream():
+    # A stream's dictionary, and where its data starts in the file (or in
+    # the decoded object stream it came from).
+    def __init__(self, dictionary, data_offset):
+        self.dictionary = dictionary
+        self.data_offset = data_offset
+
+class Parser():
+    # Parses PDF objects from data.  complete says whether data goes on to the
+    # end of whatever holds it; if not, running out raises NeedMore.
+    def __init__(self, data, pos=0, complete=True):
+        self.data = data
+        self.pos = pos
+        self.complete = complete
+
+    def check_end(self):
+        # For tokens that end where the data does - they may go on.
+        if self.pos >= len(self.data) and not self.complete:
+            raise NeedMore()
+
+    def need(self, length):
+        if self.pos + length > len(self.data):
+            if self.complete:
+                raise PdfError("unexpected end of data")
+            raise NeedMore()
+
+    def skip_space(self):
+        data = self.data
+
+        while True:
+            while self.pos < len(data) and data[self.pos] in WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(data) and data[self.pos] == 0x25:  # %
+                while self.pos < len(data) and data[self.pos] not in b"\r\n":
+                    self.pos += 1
+                continue
+
+            break
+
+        self.need(1)
+
+    def parse(self, depth=0):
+        if depth > MAX_DEPTH:
+            raise PdfError("nested too deeply")
+
+        self.skip_space()
+        data = self.data
+        c = data[self.pos]
+
+        if c == 0x3c:  # <
+            self.need(2)
+            if data[self.pos + 1] == 0x3c:
+                self.pos += 2
+                return self.parse_dictionary(depth)
+            return self.parse_hex_string()
+        if c == 0x5b:  # [
+            self.pos += 1
+            return self.parse_array(depth)
+        if c == 0x28:  # (
+            return self.parse_string()
+        if c == 0x2f:  # /
+            return self.parse_name()
+
+        match = NUMBER.match(data, self.pos)
+
+        if match is not None:
+            return self.parse_number(match)
+
+        word = self.parse_keyword()
+
+        if word == b"true":
+            return True
+        if word == b"false":
+            return False
+        if word == b"null":
+            return None
+
+        raise PdfError("unexpected %r" % word)
+
+    def parse_keyword(self):
+        start = self.pos
+
+        while self.pos < len(self.data) and self.data[self.pos] not in WHITESPACE + DELIMITERS:
+            self.pos += 1
+
+        self.check_end()
+
+        return self.data[start:self.pos]
+
+    def parse_number(self, match):
+        text = match.group(0)
+        self.pos = match.end()
+        self.check_end()
+
+        if b"." in text:
+            return float(text)
+
+        value = int(text)
+
+        # "12 0 R" - if there isn't enough left to tell, read more.
+        if not self.complete and len(self.data) - self.pos < 32:
+            raise NeedMore()
+
+        match = REFERENCE.match(self.data, self.pos)
+
+        if match is not None and value >= 0:
+            self.pos = match.end()
+            return Reference(value, int(match.group(1)))
+
+        return value
+
+    def parse_name(self):
+        start = self.pos + 1
+        self.pos = start
+
+        while self.pos < len(self.data) and self.data[self.pos] not in WHITESPACE + DELIMITERS:
+            self.pos += 1
+
+        self.check_end()
+        raw = self.data[start:self.pos]
+
+        if b"#" in raw:
+            raw = re.sub(rb"#([0-9a-fA-F]{2})", lambda m: bytes([int(m.group(1), 16)]), raw)
+
+        return Name("/" + raw.decode("utf-8", "replace"))
+
+    def parse_dictionary(self, depth):
+        dictionary = {}
+
+        while True:
+            self.skip_space()
+            self.need(2)
+
+            if self.data.startswith(b">>", self.pos):
+                self.pos += 2
+                return dictionary
+
+            key = self.parse(depth + 1)
+
+            if not isinstance(key, Name):
+                raise PdfError("dictionary key isn't a name")
+
+            dictionary[key] = self.parse(depth + 1)
+
+    def parse_array(self, depth):
+        array = []
+
+        while True:
+            self.skip_space()
+
+            if self.data[self.pos] == 0x5d:  # ]
+                self.pos += 1
+                return array
+
+            array.append(self.parse(depth + 1))
+
+    def parse_hex_string(self):
+        end = self.data.find(b">", self.pos)
+
+        if end < 0:
+            self.pos = len(self.data)
+            self.need(1)
+
+        digits = re.sub(rb"[\x00\t\n\x0c\r ]", b"", self.data[self.pos + 1:end])
+        self.pos = end + 1
+
+        if len(digits) % 2:
+            digits += b"0"
+
+        try:
+            return bytes.fromhex(digits.decode("ascii"))
+        except ValueError:
+            raise PdfError("bad hex string")
+
+    def parse_string(self):
+        data = self.data
+        pos = self.pos + 1
+        depth = 1
+        result = bytearray()
+
+        while True:
+            if pos >= len(data):
+                self.pos = pos
+                self.need(1)
+
+            c = data[pos]
+
+            if c == 0x5c:  # backslash
+                if pos + 1 >= len(data):
+                    self.pos = pos + 1
+                    self.need(1)
+
+                e = data[pos + 1]
+
+                if e in ESCAPES:
+                    result += ESCAPES[e]
+                    pos += 2
+                elif 0x30 <= e <= 0x37:
+                    digits = re.match(rb"[0-7]{1,3}", data[pos + 1:pos + 4]).group(0)
+                    result.append(int(digits, 8) & 0xff)
+                    pos += 1 + len(digits)
+                elif e == 0x0d:
+                    pos += 3 if data[pos + 2:pos + 3] == b"\n" else 2
+                elif e == 0x0a:
+                    pos += 2
+                else:
+                    result.append(e)
+                    pos += 2
+                continue
+
+            if c == 0x28:
+                depth += 1
+            elif c == 0x29:
+                depth -= 1
+                if depth == 0:
+                    self.pos = pos + 1
+                    return bytes(result)
+
+            result.append(c)
+            pos += 1
+
+class XrefTable():
+    # A classic cross-reference table: the subsections are found up front,
+    # entries are only read when they're looked up.
+    def __init__(self, reader, offset):
+        self.reader = reader
+        self.subsections = []
+
+        pos = offset + 4  # "xref"
+
+        while True:
+            head = reader.read_at(pos, 64)
+            stripped = head.lstrip(WHITESPACE)
+
+            if stripped.startswith(b"trailer"):
+                self.trailer = reader.parse_at(pos + len(head) - len(stripped) + 7)
+                break
+
+            match = SUBSECTION.match(head)
+
+            if match is None:
+                raise PdfError("bad xref subsection at %d" % pos)
+
+            start, count = int(match.group(1)), int(match.group(2))
+            entries = pos + match.end()
+
+            if count:
+                # Entries have to be 20 bytes each, some broken writers use 19.
+                if XREF_ENTRY.match(reader.read_at(entries, 20)) is None:
+                    raise PdfError("bad xref entry at %d" % entries)
+
+            self.subsections.append((start, count, entries))
+            pos = entries + count * 20
+
+            if len(self.subsections) > 10000:
+                raise PdfError("too many xref subsections")
+
+        if not isinstance(self.trailer, dict):
+            raise PdfError("bad trailer")
+
+    def lookup(self, number):
+        # ("offset", offset), ("compressed", stream number, index), "free",
+        # or None if the object isn't in this section.
+        for start, count, entries in self.subsections:
+            if start <= number < start + count:
+                match = XREF_ENTRY.match(self.reader.read_at(entries + (number - start) * 20, 20))
+
+                if match is None:
+                    raise PdfError("bad xref entry for object %d" % number)
+
+                if match.group(3) == b"f":
+                    return "free"
+
+                return ("offset", int(match.group(1)))
+
+        return None
+
+class XrefStream():
+    # A cross-reference stream, decoded whole - it's a few bytes an object.
+    def __init__(self, reader, offset):
+        stream = reader.parse_at(offset, expected=None)
+
+        if not isinstance(stream, Stream) or stream.dictionary.get("/Type") != "/XRef":
+            raise PdfError("no xref stream at %d" % offset)
+
+        self.trailer = stream.dictionary
+        self.data = reader.read_stream(stream)
+
+        widths = self.trailer.get("/W")
+        size = self.trailer.get("/Size")
+        index = self.trailer.get("/Index", [0, size])
+
+        if (not isinstance(widths, list) or len(widths) != 3 or
+                not all(isinstance(w, int) and 0 <= w <= 8 for w in widths)):
+            raise PdfError("bad /W in xref stream")
+        if not isinstance(index, list) or len(index) % 2 or not all(isinstance(i, int) for i in index):
+            raise PdfError("bad /Index in xref stream")
+
+        self.widths = widths
+        self.row_size = sum(widths)
+        self.subsections = []
+        row = 0
+
+        for i in range(0, len(index), 2):
+            self.subsections.append((index[i], index[i + 1], row))
+            row += index[i + 1]
+
+        if row * self.row_size > len(self.data):
+            raise PdfError("xref stream is too short")
+
+    def field(self, pos, width, default):
+        if width == 0:
+            return default
+        return int.from_bytes(self.data[pos:pos + width], "big")
+
+    def lookup(self, number):
+        for start, count, row in self.subsections:
+            if start <= number < start + count:
+                pos = (row + number - start) * self.row_size
+                w1, w2, w3 = self.widths
+                entry_type = self.field(pos, w1, 1)
+                second = self.field(pos + w1, w2, 0)
+                third = self.field(pos + w1 + w2, w3, 0)
+
+                if entry_type == 0:
+                    return "free"
+                if entry_type == 1:
+                    return ("offset", second)
+                if entry_type == 2:
+                    return ("compressed", second, third)
+
+                # Reserved types are to be read as null objects.
+                return "free"
+
+        return None
+
+class PdfReader():
+    def __init__(self, source):
+        self.source = source
+        self.size = source.size
+        self.sections = []
+        self.trailer = {}
+        self.object_streams = {}
+        self.depth = 0
+
+    def read_at(self, offset, length):
+        return self.source.pread(length, offset)
+
+    def parse_at(self, offset, expected=False):
+        # Parses the object at offset.  expected is the object number to find
+        # an "n g obj" header for, None for any, False for a bare object
+        # (a trailer dictionary).
+        chunk = OBJECT_CHUNK
+
+        while True:
+            data = self.read_at(offset, chunk)
+            parser = Parser(data, complete=len(data) < chunk)
+
+            try:
+                if expected is not False:
+                    match = OBJECT_HEADER.match(data)
+
+                    if match is None:
+                        raise PdfError("no object at %d" % offset)
+                    if expected is not None and int(match.group(1)) != expected:
+                        raise PdfError("expected object %d at %d" % (expected, offset))
+
+                    parser.pos = match.end()
+
+                value = parser.parse()
+
+                if isinstance(value, dict) and expected is not False:
+                    # Is it a stream?
+                    parser.skip_space()
+
+                    if data.startswith(b"stream", parser.pos):
+                        pos = parser.pos + 6
+                        parser.need(2)
+
+                        if data[pos:pos + 2] == b"\r\n":
+                            pos += 2
+                        elif data[pos:pos + 1] in (b"\n", b"\r"):
+                            pos += 1
+
+                        return Stream(value, offset + pos)
+
+                return value
+            except (NeedMore, IndexError):
+                if chunk >= MAX_OBJECT_SIZE or len(data) < chunk:
+                    raise PdfError("object at %d is too big" % offset)
+                chunk *= 4
+
+    def read_stream(self, stream):
+        # The decoded data of a stream in the file.
+        dictionary = stream.dictionary
+        length = self.resolve(dictionary.get("/Length"))
+
+        if not isinstance(length, int) or length < 0 or length > MAX_STREAM_SIZE:
+            raise PdfError("bad stream length")
+
+        data = self.read_at(stream.data_offset, length)
+
+        if len(data) < length:
+            raise PdfError("stream runs past the end of the file")
+
+        return decode_stream(dictionary, data)
+
+    def load_sections(self):
+        tail_offset = max(0, self.size - TAIL_SIZE)
+        tail = self.read_at(tail_offset, TAIL_SIZE)
+        pos = tail.rfind(b"startxref")
+
+        if pos < 0:
+            raise PdfError("no startxref")
+
+        match = re.match(rb"\s*(\d+)", tail[pos + 9:])
+
+        if match is None:
+            raise PdfError("bad startxref")
+
+        offset = int(match.group(1))
+        seen = set()
+
+        while offset is not None:
+            if offset in seen or offset >= self.size or len(self.sections) >= MAX_SECTIONS:
+                raise PdfError("bad xref chain")
+
+            seen.add(offset)
+            section = self.load_section(offset)
+            self.sections.append(section)
+            trailer = section.trailer
+
+            # Hybrid files keep the objects added later in a stream too.
+            if isinstance(trailer.get("/XRefStm"), int):
+                self.sections.append(XrefStream(self, trailer["/XRefStm"]))
+
+            # Newer trailers win.
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+
+            offset = trailer.get("/Prev")
+
+            if offset is not None and not isinstance(offset, int):
+                raise PdfError("bad /Prev")
+
+    def load_section(self, offset):
+        if self.read_at(offset, 4) == b"xref":
+            return XrefTable(self, offset)
+
+        return XrefStream(self, offset)
+
+    def get_object(self, number):
+        for section in self.sections:
+            entry = section.lookup(number)
+
+            if entry is None:
+                continue
+            if entry == "free":
+                return None
+            if entry[0] == "offset":
+                value = self.parse_at(entry[1], number)
+                if isinstance(value, Stream):
+                    raise PdfError("unexpected stream object %d" % number)
+                return value
+
+            return self.get_compressed_object(entry[1], entry[2], number)
+
+        # Missing objects are null.
+        return None
+
+    def get_compressed_object(self, stream_number, index, number):
+        if stream_number not in self.object_streams:
+            stream = None
+
+            for section in self.sections:
+                entry = section.lookup(stream_number)
+
+                if entry is not None:
+                    if entry == "free" or entry[0] != "offset":
+                        raise PdfError("bad object stream %d" % stream_number)
+                    stream = self.parse_at(entry[1], stream_number)
+                    break
+
+            if not isinstance(stream, Stream) or stream.dictionary.get("/Type") != "/ObjStm":
+                raise PdfError("bad object stream %d" % stream_number)
+
+            data = self.read_stream(stream)
+            count = stream.dictionary.get("/N")
+            first = stream.dictionary.get("/First")
+
+            if not isinstance(count, int) or not isinstance(first, int):
+                raise PdfError("bad object stream %d" % stream_number)
+
+            parser = Parser(data[:first])
+            offsets = []
+
+            for i in range(count):
+                pair = (parser.parse(), parser.parse())
+
+                if not all(isinstance(value, int) for value in pair):
+                    raise PdfError("bad object stream %d" % stream_number)
+                offsets.append(pair)
+
+            self.object_streams[stream_number] = (data, first, offsets)
+
+        data, first, offsets = self.object_streams[stream_number]
+
+        if index >= len(offsets) or offsets[index][0] != number:
+            raise PdfError("object %d isn't in object stream %d" % (number, stream_number))
+
+        return Parser(data, first + offsets[index][1]).parse()
+
+    def resolve(self, value):
+        # Follows references, to a limited depth.
+        for i in range(MAX_DEPTH):
+            if not isinstance(value, Reference):
+                return value
+            value = self.get_object(value.number)
+
+        raise PdfError("reference loop")
+
+def decode_stream(dictionary, data):
+    filters = dictionary.get("/Filter")
+    parms = dictionary.get("/DecodeParms")
+
+    if filters is None:
+        return data
+
+    if not isinstance(filters, list):
+        filters = [filters]
+        parms = [parms]
+    elif not isinstance(parms, list):
+        parms = [parms] * len(filters)
+
+    for name, parm in zip(filters, parms):
+        if name not in ("/FlateDecode", "/Fl"):
+            raise PdfError("unsupported filter %s" % name)
+
+        decompressor = zlib.decompressobj()
+
+        try:
+            data = decompressor.decompress(data, MAX_DECODED_SIZE)
+        except zlib.error as e:
+            raise PdfError("bad compressed data: %s" % e)
+
+        if decompressor.unconsumed_tail:
+            raise PdfError("decoded stream is too big")
+
+        if isinstance(parm, dict) and parm.get("/Predictor", 1) > 1:
+            data = unpredict(data, parm)
+
+    return data
+
+def unpredict(data, parm):
+    # Undoes the PNG predictors cross-reference streams are usually stored
+    # with.
+    predictor = parm.get("/Predictor", 1)
+    columns = parm.get("/Columns", 1)
+    colors = parm.get("/Colors", 1)
+    bits = parm.get("/BitsPerComponent", 8)
+
+    if predictor < 10 or not all(isinstance(v, int) and v > 0 for v in (columns, colors, bits)):
+        raise PdfError("unsupported predictor %s" % predictor)
+
+    pixel = max(1, colors * bits // 8)
+    row_size = (columns * colors * bits + 7) // 8
+    previous = bytearray(row_size)
+    result = bytearray()
+
+    for pos in range(0, len(data) - row_size, row_size + 1):
+        kind = data[pos]
+        row = bytearray(data[pos + 1:pos + 1 + row_size])
+
+        if kind == 1:
+            for i in range(pixel, row_size):
+                row[i] = (row[i] + row[i - pixel]) & 0xff
+        elif kind == 2:
+            for i in range(row_size):
+                row[i] = (row[i] + previous[i]) & 0xff
+        elif kind == 3:
+            for i in range(row_size):
+                left = row[i - pixel] if i >= pixel else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xff
+        elif kind == 4:
+            for i in range(row_size):
+                a = row[i - pixel] if i >= pixel else 0
+                b = previous[i]
+                c = previous[i - pixel] if i >= pixel else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                predicted = a if pa <= pb and pa <= pc else b if pb <= pc else c
+                row[i] = (row[i] + predicted) & 0xff
+        elif kind != 0:
+            raise PdfError("bad PNG predictor %d" % kind)
+
+        result += row
+        previous = row
+
+    return bytes(result)
+
+def decode_text(value):
+    # A PDF text string, or PdfError if it's something pypdf should decode.
+    if not isinstance(value, bytes):
+        raise PdfError("text isn't a string")
+
+    if value.startswith(b"\xfe\xff"):
+        try:
+            return value[2:].decode("utf-16-be")
+        except UnicodeDecodeError:
+            raise PdfError("bad UTF-16 text")
+    if value.startswith(b"\xef\xbb\xbf"):
+        try:
+            return value[3:].decode("utf-8")
+        except UnicodeDecodeError:
+            raise PdfError("bad UTF-8 text")
+
+    if not PDFDOC_LATIN1.issuperset(value):
+        raise PdfError("text needs PDFDocEncoding")
+
+    return value.decode("latin-1")
+
+def read_pdf(source, info=True, pages=True):
+    # Returns a dict with "title" and "artist" (the author), if info is set,
+    # and "pages", if pages is set - None for anything the file doesn't have.
+    # Returns None if the file has to be left to pypdf.  source is a
+    # media_source.Source.
+    try:
+        if b"%PDF-" not in source.pread(1024, 0):
+            return None
+
+        reader = PdfReader(source)
+        reader.load_sections()
+        trailer = reader.trailer
+
+        # Strings are encrypted too, pypdf knows how to undo that.
+        if "/Encrypt" in trailer:
+            return None
+
+        values = {}
+
+        if pages:
+            catalog = reader.resolve(trailer.get("/Root"))
+
+            if not isinstance(catalog, dict):
+                raise PdfError("no catalog")
+
+            tree = reader.resolve(catalog.get("/Pages"))
+
+            if not isinstance(tree, dict):
+                raise PdfError("no page tree")
+
+            count = reader.resolve(tree.get("/Count"))
+
+            if not isinstance(count, int) or count < 0:
+                raise PdfError("bad page count")
+
+            values["pages"] = count
+
+        if info:
+            document = reader.resolve(trailer.get("/Info"))
+
+            if document is not None and not isinstance(document, dict):
+                raise PdfError("bad /Info")
+
+            for key, field in (("/Title", "title"), ("/Author", "artist")):
+                value = reader.resolve(document.get(key)) if document is not None else None
+                values[field] = None if value is None else decode_text(value)
+
+            # As pypdf has it.
+            if values["title"] == "":
+                values["title"] = None
+
+        return values
+    except (PdfError, IndexError, KeyError, TypeError, AttributeError, ValueError, RecursionError, OSError):
+        return None
@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+# Searches the metadata nemo-media-columns has already extracted.
+#
+# Everything is answered from the cache database and its indexes (see
+# media_cache.py) - no files are opened, or even listed.  That also means
+# only files that have been shown in Nemo, or scanned with
+# nemo-media-columns-scan, are found, as they were when they were last
+# processed.  The cache also only keeps the entries used most recently (see
+# cache-size), so a search may miss files that were processed long ago.
+#
+#   query = MediaQuery()
+#   query.add_path("/srv/music")
+#   query.add_type("flac")
+#   query.add_range("length", 3600, None)
+#
+#   for path, mimetype, info in query.run(open_index()):
+#       ...
+
+import os
+import re
+import sqlite3
+import fnmatch
+
+import media_cache
+import media_info
+
+# Fields that can be searched and sorted on.
+TEXT_FIELDS = media_cache.INDEXED_TEXT_FIELDS
+NUMBER_FIELDS = media_cache.INDEXED_NUMBER_FIELDS
+SORT_FIELDS = ("path", "size", "mtime") + TEXT_FIELDS + NUMBER_FIELDS
+
+class QueryError(Exception):
+    pass
+
+def open_index(path=media_cache.DEFAULT_PATH):
+    # A read-only connection to the cache.  Raises QueryError if there's no
+    # cache, or it's from another version.
+    try:
+        conn = sqlite3.connect("file:%s?mode=ro" % path, uri=True, timeout=media_cache.BUSY_TIMEOUT)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.Error as e:
+        raise QueryError("could not open the metadata cache at '%s': %s" % (path, e))
+
+    if version != media_cache.SCHEMA_VERSION:
+        conn.close()
+        raise QueryError("the metadata cache at '%s' is from another version of nemo-media-columns, "
+                         "run nemo-media-columns-scan to rebuild it" % path)
+
+    return conn
+
+def count_files(conn):
+    # How many files the cache knows about.
+    try:
+        return conn.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+    except sqlite3.Error as e:
+        raise QueryError("query failed: %s" % e)
+
+def escape_like(value):
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+def glob_to_like(pattern):
+    # * matches anything, the rest is literal.
+    return "%".join(escape_like(part) for part in pattern.split("*"))
+
+class MediaQuery():
+    def __init__(self):
+        self.paths = []
+        self.types = []
+        self.conditions = []
+        self.params = []
+
+    def add_path(self, path):
+        # Files at or under path.  Several paths are alternatives.
+        if "://" not in path:
+            path = os.path.abspath(path)
+
+        # Everything under "dir/" sorts between "dir/" and "dir0", so the
+        # primary key can be used.
+        prefix = path.rstrip("/") + "/"
+        self.paths.append(("(path = ? OR (path >= ? AND path < ?))", [path, prefix, prefix[:-1] + "0"]))
+
+    def add_type(self, pattern):
+        # A mime type, possibly with * wildcards ("image/*"), or just the part
+        # after the slash ("flac" for audio/flac and audio/x-flac).  Several
+        # types are alternatives.
+        self.types.append(pattern)
+
+    def match_types(self, mimetypes):
+        # The ones of mimetypes that match the types asked for.
+        matched = []
+
+        for mimetype in mimetypes:
+            subtype = mimetype.partition("/")[2]
+
+            for pattern in self.types:
+                if "/" in pattern:
+                    if fnmatch.fnmatchcase(mimetype, pattern):
+                        break
+                elif fnmatch.fnmatchcase(subtype, pattern) or fnmatch.fnmatchcase(subtype, "x-" + pattern):
+                    break
+            else:
+                continue
+
+            matched.append(mimetype)
+
+        return matched
+
+    def add_text(self, field, pattern, prefix=False):
+        # Case-insensitive, with * wildcards.  With prefix, values that start
+        # with pattern match too: a date of "2019" matches "2019-06-01".
+        if field not in TEXT_FIELDS:
+            raise QueryError("can't search on '%s'" % field)
+
+        if prefix and not pattern.endswith("*"):
+            pattern += "*"
+
+        if "*" in pattern:
+            self.conditions.append("%s LIKE ? ESCAPE '\\'" % field)
+            self.params.append(glob_to_like(pattern))
+        else:
+            self.conditions.append("%s = ? COLLATE NOCASE" % field)
+            self.params.append(pattern)
+
+    def add_range(self, field, low, high):
+        # Inclusive, either end may be None.  Text fields compare as text,
+        # and a high end matches everything that starts with it: a date range
+        # of "2019-06" to "2019-06" is all of June 2019.
+        if field not in TEXT_FIELDS and field not in NUMBER_FIELDS:
+            raise QueryError("can't search on '%s'" % field)
+
+        if field in TEXT_FIELDS:
+            collate = " COLLATE NOCASE"
+            # "~" sorts after the digits and separators of dates.
+            high = None if high is None else high + "~"
+            high_op = "<"
+        else:
+            collate = ""
+            high_op = "<="
+
+        if low is not None:
+            self.conditions.append("%s >= ?%s" % (field, collate))
+            self.params.append(low)
+        if high is not None:
+            self.conditions.append("%s %s ?%s" % (field, high_op, collate))
+            self.params.append(high)
+
+    def get_sql(self, mimetypes=None, sort="path", limit=None):
+        # mimetypes are the types to look for, as given by match_types().
+        if sort not in SORT_FIELDS:
+            raise QueryError("can't sort on '%s'" % sort)
+
+        conditions = list(self.conditions)
+        params = list(self.params)
+
+        if mimetypes is not None:
+            conditions.insert(0, "mimetype IN (%s)" % ", ".join("?" * len(mimetypes)))
+            params[0:0] = mimetypes
+
+        if self.paths:
+            conditions.insert(0, "(%s)" % " OR ".join(condition for condition, values in self.paths))
+            params[0:0] = [value for condition, values in self.paths for value in values]
+
+        sql = "SELECT path, inode, size, mtime, mimetype, %s FROM media" % ", ".join(media_info.FIELDS)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        sql += " ORDER BY %s, path" % sort if sort != "path" else " ORDER BY path"
+
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+
+        return sql, params
+
+    def run(self, conn, sort="path", limit=None, check=False):
+        # Yields (path, mimetype, FileExtensionInfo).  With check, files that
+        # are gone or have changed since they were processed are left out.
+        try:
+            mimetypes = None
+
+            # There are only a few of them, and they come straight from the
+            # index - far quicker than matching every file.
+            if self.types:
+                mimetypes = self.match_types(mimetype for (mimetype,) in
+                                             conn.execute("SELECT DISTINCT mimetype FROM media "
+                                                          "WHERE mimetype IS NOT NULL"))
+
+            # What's left out by check doesn't count towards the limit.
+            sql, params = self.get_sql(mimetypes, sort, None if check else limit)
+            cursor = conn.execute(sql, params)
+        except sqlite3.Error as e:
+            raise QueryError("query failed: %s" % e)
+
+        found = 0
+
+        for row in cursor:
+            if check and limit is not None and found >= limit:
+                break
+
+            path, inode, size, mtime, mimetype = row[:5]
+
+            if check and "://" not in path:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if (stat.st_ino, stat.st_size, stat.st_mtime_ns) != (inode, size, mtime):
+                    continue
+
+            found += 1
+
+            yield path, mimetype, media_info.FileExtensionInfo(dict(zip(media_info.FIELDS, row[5:])))
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+# Where the extractors read a file from.
+#
+# Local files are read with pread() on a plain file descriptor.  Anything
+# else (sftp, smb, mtp... through gvfs) is read through a GIO stream, seeking
+# to just the ranges the header readers ask for.  Those ranges are fetched in
+# blocks and kept in a cache shared by every file the process looks at, so a
+# fallback parser going over the same header again doesn't fetch it twice.
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from gi.repository import GLib, Gio
+
+BLOCK_SIZE = 64 * 1024
+CACHE_SIZE = 16 * 1024 * 1024
+
+# Streams that can't seek are skipped forward instead, but not this far.
+MAX_SKIP = 4 * 1024 * 1024
+
+STAT_ATTRIBUTES = "standard::size,time::modified,time::modified-usec"
+
+def is_local(location):
+    return location.startswith("/")
+
+class StatResult():
+    # The parts of os.stat_result the cache uses, for files that aren't local.
+    def __init__(self, size, mtime_ns):
+        self.st_ino = 0
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+
+def stat_uri(uri):
+    try:
+        info = Gio.File.new_for_uri(uri).query_info(STAT_ATTRIBUTES, Gio.FileQueryInfoFlags.NONE, None)
+    except GLib.Error as e:
+        raise OSError(e.message)
+
+    mtime = info.get_attribute_uint64("time::modified")
+    usec = info.get_attribute_uint32("time::modified-usec")
+
+    return StatResult(info.get_size(), (mtime * 1000000 + usec) * 1000)
+
+class BlockCache():
+    def __init__(self, size=CACHE_SIZE):
+        self.max_blocks = max(1, size // BLOCK_SIZE)
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+            return block
+
+    def put(self, key, block):
+        with self.lock:
+            self.blocks[key] = block
+            self.blocks.move_to_end(key)
+
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+block_cache = BlockCache()
+
+class Source():
+    # path is set for local files, for the libraries that can only open a
+    # path themselves.
+    path = None
+    size = 0
+
+    def pread(self, length, offset):
+        # Up to length bytes at offset, fewer only at the end of the file.
+        raise NotImplementedError()
+
+    def open(self):
+        # A binary file object, for libraries that read it themselves.
+        return io.BufferedReader(SourceFile(self), BLOCK_SIZE)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class FileSource(Source):
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+
+        try:
+            self.size = os.fstat(self.fd).st_size
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def pread(self, length, offset):
+        return os.pread(self.fd, length, offset)
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class GioSource(Source):
+    def __init__(self, uri, cache=block_cache):
+        self.uri = uri
+        self.cache = cache
+        self.file = Gio.File.new_for_uri(uri)
+        self.stream = None
+
+        stat = stat_uri(uri)
+        self.size = stat.st_size
+        # A new version of the file doesn't share blocks with the old one.
+        self.key = (uri, stat.st_size, stat.st_mtime_ns)
+
+    def _open_stream(self):
+        try:
+            self.stream = self.file.read(None)
+        except GLib.Error as e:
+            raise OSError(e.message)
+
+    def _fetch(self, index):
+        # One block, from the stream.
+        offset = index * BLOCK_SIZE
+
+        try:
+            if self.stream is None:
+                self._open_stream()
+
+            position = self.stream.tell()
+
+            if position != offset:
+                if self.stream.can_seek():
+                    self.stream.seek(offset, GLib.SeekType.SET, None)
+                else:
+                    if position > offset:
+                        self.stream.close(None)
+                        self._open_stream()
+                        position = 0
+                    if offset - position > MAX_SKIP:
+                        raise OSError("stream can't seek to %d" % offset)
+                    while position < offset:
+                        skipped = self.stream.skip(offset - position, None)
+                        if skipped <= 0:
+                            break
+                        position += skipped
+
+            chunks = []
+            remaining = BLOCK_SIZE
+
+            while remaining > 0:
+                data = self.stream.read_bytes(remaining, None).get_data()
+                if not data:
+                    break
+                chunks.append(data)
+                remaining -= len(data)
+        except GLib.Error as e:
+            raise OSError(e.message)
+
+        return b"".join(chunks)
+
+    def pread(self, length, offset):
+        if offset >= self.size or length <= 0:
+            return b""
+
+        end = min(offset + length, self.size)
+        parts = []
+
+        for index in range(offset // BLOCK_SIZE, (end - 1) // BLOCK_SIZE + 1):
+            key = self.key + (index,)
+            block = self.cache.get(key)
+
+            if block is None:
+                block = self._fetch(index)
+                self.cache.put(key, block)
+
+            start = index * BLOCK_SIZE
+            parts.append(block[max(offset, start) - start:end - start])
+
+        return b"".join(parts)
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.stream.close(None)
+            except GLib.Error:
+                pass
+            self.stream = None
+
+class SourceFile(io.RawIOBase):
+    # A read-only file object on top of a Source.
+    def __init__(self, source):
+        self.source = source
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.source.size
+
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+
+        self.position = offset
+        return offset
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        data = self.source.pread(len(buffer), self.position)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+def open_source(location):
+    # location is a local path or a URI.
+    if is_local(location):
+        return FileSource(location)
+
+    return GioSource(location)
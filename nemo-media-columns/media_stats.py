@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+# Runtime statistics for nemo-media-columns, to find out where the time goes
+# on a real workload.
+#
+# Extractions are counted per extractor and per mime type: how many there
+# were, how they ended (done, failed, timed out, cancelled), the bytes read
+# and a histogram of how long they took.  Alongside those are the cache hit
+# rate and how many files were waiting for a worker.
+#
+# Nothing is written unless the write-stats setting is on; then the numbers
+# are flushed to a JSON file in the user cache dir every STATS_INTERVAL
+# seconds, one file per process (Nemo and nemo-desktop both load us).
+#
+# Run as a script, it prints the stats files it finds.
+
+import os
+import json
+import time
+import threading
+
+from gi.repository import GLib
+
+STATS_DIR = os.path.join(GLib.get_user_cache_dir(), "nemo-media-columns")
+
+# How often the stats file is rewritten (seconds).
+STATS_INTERVAL = 30
+
+# Histogram bucket upper bounds (ms).  The last bucket takes everything else.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+OUTCOMES = ("done", "failed", "timeout", "cancelled")
+
+def get_process_name():
+    try:
+        with open("/proc/self/comm") as f:
+            return f.read().strip() or "nemo"
+    except OSError:
+        return "nemo"
+
+def get_stats_path():
+    return os.path.join(STATS_DIR, "stats-%s.json" % get_process_name())
+
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def add(self, ms):
+        for i, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.counts[i] += 1
+                return
+
+        self.counts[-1] += 1
+
+    def percentile(self, p):
+        # The upper bound of the bucket the percentile falls in, None for the
+        # last bucket or with no samples.
+        total = sum(self.counts)
+
+        if total == 0:
+            return None
+
+        rank = p / 100.0 * total
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else None
+
+        return None
+
+    def to_dict(self):
+        return {"buckets_ms": list(BUCKETS), "counts": list(self.counts),
+                "p50_ms": self.percentile(50), "p95_ms": self.percentile(95), "p99_ms": self.percentile(99)}
+
+class ExtractionCounters():
+    def __init__(self):
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.bytes_read = 0
+        self.total_ms = 0.0
+        self.times = Histogram()
+
+    def add(self, outcome, ms, bytes_read):
+        self.outcomes[outcome] += 1
+        self.total_ms += ms
+        self.bytes_read += bytes_read or 0
+        self.times.add(ms)
+
+    def to_dict(self):
+        count = sum(self.outcomes.values())
+        result = dict(self.outcomes)
+        result.update({"count": count, "bytes_read": self.bytes_read,
+                       "mean_ms": round(self.total_ms / count, 2) if count else None,
+                       "time": self.times.to_dict()})
+
+        return result
+
+class RuntimeStats():
+    # Updated from the worker threads and the main loop.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        self.path = None
+        self.flush_id = 0
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.by_extractor = {}
+            self.by_mimetype = {}
+            # thumbnails counts the partial hits and misses that a thumbnail
+            # filled in without an extraction, xattrs the lookups that found
+            # values stored on the file - both are among the other counts too.
+            self.cache = {"hits": 0, "partial": 0, "misses": 0, "known_failures": 0, "thumbnails": 0, "xattrs": 0}
+            self.queue_depth = 0
+            self.max_queue_depth = 0
+            self.queue_samples = 0
+            self.queue_total = 0
+
+    def record_extraction(self, extractor, mimetype, outcome, seconds, bytes_read=None):
+        ms = seconds * 1000
+
+        with self.lock:
+            for counters, key in ((self.by_extractor, extractor), (self.by_mimetype, mimetype)):
+                if key not in counters:
+                    counters[key] = ExtractionCounters()
+                counters[key].add(outcome, ms, bytes_read)
+
+    def record_cache(self, result):
+        # result is one of the keys of self.cache.
+        with self.lock:
+            self.cache[result] += 1
+
+    def record_queue_depth(self, depth):
+        with self.lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self.queue_samples += 1
+            self.queue_total += depth
+
+    def to_dict(self):
+        with self.lock:
+            lookups = sum(self.cache.values()) - self.cache["thumbnails"] - self.cache["xattrs"]
+
+            return {
+                "pid": os.getpid(),
+                "started": round(self.started),
+                "updated": round(time.time()),
+                "extractors": dict((key, c.to_dict()) for key, c in sorted(self.by_extractor.items())),
+                "mimetypes": dict((key, c.to_dict()) for key, c in sorted(self.by_mimetype.items())),
+                "cache": dict(self.cache, hit_rate=round(self.cache["hits"] / lookups, 4) if lookups else None),
+                "queue": {"depth": self.queue_depth, "max_depth": self.max_queue_depth,
+                          "mean_depth": round(self.queue_total / self.queue_samples, 2) if self.queue_samples else None},
+            }
+
+    def enable(self, path):
+        # Main loop only.  Starts flushing to path every STATS_INTERVAL
+        # seconds, or stops if path is None.
+        if path == self.path:
+            return
+
+        if self.flush_id:
+            GLib.source_remove(self.flush_id)
+            self.flush_id = 0
+
+        if self.path is not None:
+            self.flush()
+
+        self.path = path
+
+        if path is not None:
+            self.reset()
+            self.flush_id = GLib.timeout_add_seconds(STATS_INTERVAL, self.on_flush_timeout)
+
+    def on_flush_timeout(self):
+        self.flush()
+        return True
+
+    def flush(self):
+        if self.path is None:
+            return
+
+        # Written whole and renamed, so readers never see half a file.
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            with open(temp_path, "w") as f:
+                json.dump(self.to_dict(), f, indent=1)
+
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print("nemo-media-columns: could not write the stats to '%s': %s" % (self.path, e))
+
+if __name__ == "__main__":
+    import glob
+
+    for path in sorted(glob.glob(os.path.join(STATS_DIR, "stats-*.json"))):
+        with open(path) as f:
+            stats = json.load(f)
+
+        print("%s (pid %d, since %s)" % (path, stats["pid"], time.strftime("%Y-%m-%d %H:%M", time.localtime(stats["started"]))))
+        cache = stats["cache"]
+        print("  cache: %d hits, %d partial, %d misses, %d known failures, %d from thumbnails, %d from xattrs"
+              % (cache["hits"], cache["partial"], cache["misses"], cache["known_failures"],
+                 cache.get("thumbnails", 0), cache.get("xattrs", 0)))
+        print("  queue: depth %d, max %d, mean %s" % (stats["queue"]["depth"], stats["queue"]["max_depth"],
+                                                      stats["queue"]["mean_depth"]))
+
+        for section in ("extractors", "mimetypes"):
+            for key, c in stats[section].items():
+                # None is beyond the last bucket.
+                p50, p95 = (c["time"][name] or ">%d" % BUCKETS[-1] for name in ("p50_ms", "p95_ms"))
+                print("  %-30s %6d  %s  p50 %s ms, p95 %s ms, %.1f MiB read"
+                      % (key, c["count"], " ".join("%s %d" % (outcome, c[outcome]) for outcome in OUTCOMES),
+                         p50, p95, c["bytes_read"] / (1024 * 1024)))
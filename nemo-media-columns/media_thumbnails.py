@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+# Image sizes and video lengths from the freedesktop.org thumbnail cache.
+#
+# Nemo has usually made a thumbnail of a file before we're asked about it.
+# Thumbnails are PNGs named after the MD5 of the file's URI, and their tEXt
+# chunks record the original's URI and mtime, and often its pixel size and,
+# for videos, its length.  When the mtime still matches, those can fill in
+# the columns without opening the original - a multi-GB RAW or video file,
+# possibly on a network share.
+#
+# https://specifications.freedesktop.org/thumbnail-spec/latest/
+
+import os
+import struct
+import hashlib
+
+from gi.repository import GLib
+
+import media_info
+
+THUMBNAIL_DIR = os.path.join(GLib.get_user_cache_dir(), "thumbnails")
+
+# Largest first - Nemo asks for large thumbnails unless zoomed right out.
+THUMBNAIL_SIZES = ("large", "x-large", "xx-large", "normal")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Thumbnails are small, anything bigger isn't one.
+MAX_THUMBNAIL_SIZE = 4 * 1024 * 1024
+
+# The attributes a thumbnail can fill in.
+ATTRIBUTES = frozenset(("pixeldimensions", "length"))
+
+def get_thumbnail_paths(uri):
+    name = hashlib.md5(uri.encode("utf-8")).hexdigest() + ".png"
+
+    return [os.path.join(THUMBNAIL_DIR, size, name) for size in THUMBNAIL_SIZES]
+
+def read_text_chunks(path):
+    # Returns the tEXt keywords and values of a PNG, or None if it isn't one.
+    # Thumbnailers write them ahead of the image data, so reading stops
+    # there.
+    text = {}
+
+    with open(path, "rb") as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            return None
+
+        while True:
+            header = f.read(8)
+
+            if len(header) < 8:
+                return text
+
+            length, chunk_type = struct.unpack(">I4s", header)
+
+            if chunk_type in (b"IDAT", b"IEND") or length > MAX_THUMBNAIL_SIZE:
+                return text
+
+            if chunk_type != b"tEXt":
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)
+            keyword, sep, value = data.partition(b"\x00")
+
+            if sep:
+                text[keyword.decode("latin-1")] = value.decode("utf-8", "replace")
+
+def get_number(text, key):
+    try:
+        value = float(text[key])
+    except (KeyError, ValueError):
+        return None
+
+    return value if value > 0 else None
+
+def lookup(uri, stat, wanted):
+    # Returns a dict of FileExtensionInfo fields for those of the wanted
+    # attributes that an up-to-date thumbnail of uri records, or None if
+    # there's no such thumbnail.  stat is the original's, only its size and
+    # mtime are used.
+    wanted = ATTRIBUTES.intersection(wanted)
+
+    if not wanted:
+        return None
+
+    for path in get_thumbnail_paths(uri):
+        try:
+            text = read_text_chunks(path)
+        except (OSError, struct.error):
+            continue
+
+        if not text or text.get("Thumb::URI") != uri:
+            continue
+
+        # MTime is in whole seconds; Size is optional.
+        try:
+            if int(float(text["Thumb::MTime"])) != stat.st_mtime_ns // 1000000000:
+                continue
+            if "Thumb::Size" in text and int(text["Thumb::Size"]) != stat.st_size:
+                continue
+        except (KeyError, ValueError):
+            continue
+
+        fields = {}
+
+        if "pixeldimensions" in wanted:
+            width = get_number(text, "Thumb::Image::Width")
+            height = get_number(text, "Thumb::Image::Height")
+
+            if width is not None and height is not None:
+                fields["width"] = int(width)
+                fields["height"] = int(height)
+
+        if "length" in wanted:
+            length = get_number(text, "Thumb::Movie::Length")
+
+            if length is not None:
+                fields["length"] = length
+
+        # The sizes are made by the same thumbnailer, so they record the
+        # same things - there's no point looking at the others.
+        return fields
+
+    return None
+
+def get_attributes(fields):
+    # The attributes a lookup() result fills in.
+    return frozenset(attribute for attribute in ATTRIBUTES
+                     if all(field in fields for field in media_info.get_fields((attribute,))))
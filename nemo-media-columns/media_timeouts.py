@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Per-format timeouts for nemo-media-columns, learned from how long files
+# actually take.
+#
+# A single timeout doesn't suit a 4 KB JPEG and a 40 GB MKV alike: too low
+# and the slow formats come up blank, too high and a hung parser keeps a
+# worker busy for nothing.  So the time of every extraction is kept, for the
+# last WINDOW files of each extractor, file size bucket and kind of mount
+# (local or remote), and the deadline for the next file of that kind is its
+# 99th percentile times FACTOR.
+#
+# The user's timeout stays the limit: learned deadlines are never longer,
+# only shorter for the kinds of files that are always quick, down to
+# MIN_TIMEOUT.  Extractions that timed out count as taking the whole
+# deadline, so a kind of file that starts timing out gets more time again,
+# FACTOR at a time.  Until there are MIN_SAMPLES of a kind the user's timeout
+# is used as it is.
+#
+# The samples and deadlines are kept in a JSON file in the user cache dir, so
+# they survive restarts.  Run as a script, it prints the learned deadlines.
+
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+
+from gi.repository import GLib
+
+TIMEOUTS_PATH = os.path.join(GLib.get_user_cache_dir(), "nemo-media-columns", "timeouts.json")
+
+# Bump if the samples change meaning, old ones are then dropped.
+TIMEOUTS_VERSION = 2
+
+# How many of the most recent extractions of each kind are kept.
+WINDOW = 200
+
+# How many are needed before the deadline is learned from them.
+MIN_SAMPLES = 20
+
+PERCENTILE = 99
+FACTOR = 3.0
+
+# The shortest a learned deadline gets (seconds).
+MIN_TIMEOUT = 0.1
+
+# The timeout when there's no user one (seconds).
+MAX_TIMEOUT = 30.0
+
+# Upper bounds of the file size buckets (bytes).  The last bucket takes
+# everything else.
+SIZE_BUCKETS = (1 << 20, 16 << 20, 256 << 20, 4 << 30)
+SIZE_LABELS = ("1M", "16M", "256M", "4G", "more")
+
+# How often the samples are saved, when they've changed (seconds).
+SAVE_INTERVAL = 60
+
+def get_key(extractor, size, remote):
+    bucket = SIZE_LABELS[bisect.bisect_left(SIZE_BUCKETS, size)]
+
+    return "%s:%s:%s" % (extractor, "remote" if remote else "local", bucket)
+
+def get_percentile(samples, p):
+    ordered = sorted(samples)
+
+    return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+class AdaptiveTimeouts():
+    # Used from the worker threads, and saved from the main loop.
+    def __init__(self, path=TIMEOUTS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.deadlines = {}
+        self.timeout = MAX_TIMEOUT
+        self.enabled = False
+        self.dirty = False
+        self.save_id = 0
+
+        self.load()
+
+    def configure(self, timeout, enabled):
+        # timeout is the user's, used until a deadline is learned.  Main
+        # loop only.
+        with self.lock:
+            self.timeout = timeout
+            self.enabled = enabled
+            self.deadlines = dict((key, self._learn(samples)) for key, samples in self.samples.items())
+
+        if enabled and not self.save_id:
+            self.save_id = GLib.timeout_add_seconds(SAVE_INTERVAL, self.on_save_timeout)
+        elif not enabled and self.save_id:
+            GLib.source_remove(self.save_id)
+            self.save_id = 0
+
+            if self.dirty:
+                self.save()
+
+    def _learn(self, samples):
+        if len(samples) < MIN_SAMPLES:
+            return None
+
+        deadline = get_percentile(samples, PERCENTILE) * FACTOR
+
+        return min(max(deadline, MIN_TIMEOUT), self.timeout)
+
+    def get(self, key):
+        # The deadline for the next extraction of this kind (seconds).
+        with self.lock:
+            if not self.enabled:
+                return self.timeout
+
+            deadline = self.deadlines.get(key)
+
+            return self.timeout if deadline is None else deadline
+
+    def record(self, key, seconds):
+        # seconds is how long an extraction took, or its deadline if it
+        # timed out.  Failed and cancelled ones tell us nothing.
+        with self.lock:
+            if not self.enabled:
+                return
+
+            samples = self.samples.get(key)
+
+            if samples is None:
+                samples = self.samples[key] = deque(maxlen=WINDOW)
+
+            samples.append(seconds)
+            self.deadlines[key] = self._learn(samples)
+            self.dirty = True
+
+    def to_dict(self):
+        with self.lock:
+            return {"version": TIMEOUTS_VERSION, "updated": round(time.time()),
+                    "timeouts": dict((key, {"deadline": round(self.deadlines[key], 3) if self.deadlines.get(key) else None,
+                                            "samples": [round(s, 4) for s in samples]})
+                                     for key, samples in sorted(self.samples.items()))}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+
+            if saved["version"] != TIMEOUTS_VERSION:
+                return
+
+            for key, learned in saved["timeouts"].items():
+                self.samples[key] = deque((float(s) for s in learned["samples"]), maxlen=WINDOW)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            print("nemo-media-columns: ignoring the learned timeouts in '%s': %s" % (self.path, e))
+            self.samples = {}
+
+    def on_save_timeout(self):
+        if self.dirty:
+            self.save()
+
+        return True
+
+    def save(self):
+        # Written whole and renamed, Nemo and nemo-desktop both save here.
+        self.dirty = False
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            with open(temp_path, "w") as f:
+                json.dump(self.to_dict(), f, indent=1)
+
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print("nemo-media-columns: could not save the learned timeouts to '%s': %s" % (self.path, e))
+
+if __name__ == "__main__":
+    with open(TIMEOUTS_PATH) as f:
+        saved = json.load(f)
+
+    print("%s (updated %s)" % (TIMEOUTS_PATH, time.strftime("%Y-%m-%d %H:%M", time.localtime(saved["updated"]))))
+
+    for key, learned in saved["timeouts"].items():
+        samples = learned["samples"]
+        deadline = "%.0f ms" % (learned["deadline"] * 1000) if learned["deadline"] else "not learned yet"
+        print("  %-30s %4d samples, p50 %.1f ms, p99 %.1f ms, deadline %s"
+              % (key, len(samples), get_percentile(samples, 50) * 1000,
+                 get_percentile(samples, PERCENTILE) * 1000, deadline))
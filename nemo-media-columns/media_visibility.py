@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+# Tracks which of our columns are visible, so nemo-media-columns only extracts
+# what is actually displayed.
+#
+# Nemo keeps the list view columns of a directory in its metadata, falling
+# back to the default-visible-columns setting.  Files are served with the
+# attributes wanted at the time; when a directory later shows more of our
+# columns, those files are invalidated so Nemo asks for them again.
+
+import time
+from collections import OrderedDict
+
+from gi.repository import GLib, Gio
+
+METADATA_KEY = "metadata::nemo-list-view-visible-columns"
+
+# How long a directory's column list is trusted before asking again (seconds).
+DIRECTORY_TTL = 2.0
+
+# How many directories we keep served files for, to fill them in later.
+MAX_DIRECTORIES = 8
+
+# How many directories' column lists we remember, most recently used first.
+MAX_LOOKED_UP = 64
+
+# A directory whose columns haven't changed is checked again after
+# DIRECTORY_TTL, then twice as long each time, and forgotten after
+# STABLE_CHECKS checks (about two minutes, all told) unless it's being
+# served again.
+STABLE_CHECKS = 5
+
+def get_settings(schema_id):
+    source = Gio.SettingsSchemaSource.get_default()
+
+    if source is None or source.lookup(schema_id, True) is None:
+        return None
+
+    return Gio.Settings(schema_id=schema_id)
+
+class ServedDirectory():
+    # The files of one directory that didn't get all of our attributes.
+    # Nemo can only be told to ask again through the files' FileInfos, so
+    # those are kept, but they're only looked at when the directory's
+    # columns change.
+    def __init__(self):
+        self.files = {}
+        # What every one of them was served with.
+        self.attributes = None
+        self.reset()
+
+    def reset(self):
+        self.checks_left = STABLE_CHECKS
+        self.interval = DIRECTORY_TTL
+        self.next_check = time.monotonic() + self.interval
+
+    def add(self, file, attributes):
+        self.files[file.get_uri()] = (file, attributes)
+        self.attributes = attributes if self.attributes is None else self.attributes & attributes
+
+    def remove(self, uri):
+        self.files.pop(uri, None)
+
+    def take_missing(self, wanted):
+        # Forgets and returns the files that lack some of wanted.
+        missing = [file for file, attributes in self.files.values() if not wanted <= attributes]
+        self.files = dict((uri, entry) for uri, entry in self.files.items() if wanted <= entry[1])
+        self.attributes = None
+
+        for file, attributes in self.files.values():
+            self.attributes = attributes if self.attributes is None else self.attributes & attributes
+
+        return missing
+
+class VisibleColumns():
+    # Main loop only.  A directory's columns are looked up asynchronously -
+    # until the answer is in, the defaults are used, and files that turn out
+    # to need more are invalidated so Nemo asks for them again.
+    def __init__(self, attribute_by_column):
+        self.attribute_by_column = attribute_by_column
+        self.attributes = frozenset(attribute_by_column.values())
+
+        # dir uri -> (attributes, time looked up)
+        self.directories = OrderedDict()
+        # dir uris being looked up
+        self.pending = set()
+        # dir uri -> ServedDirectory
+        self.served = OrderedDict()
+        self.refresh_id = 0
+
+        self.list_settings = get_settings("org.nemo.list-view")
+        self.icon_settings = get_settings("org.nemo.icon-view")
+
+        self.list_default = frozenset()
+        self.captions = frozenset()
+        self.load_default()
+
+        for settings in (self.list_settings, self.icon_settings):
+            if settings is not None:
+                settings.connect("changed", self.on_settings_changed)
+
+    def load_default(self):
+        if self.list_settings is not None:
+            self.list_default = self.columns_to_attributes(self.list_settings.get_strv("default-visible-columns"))
+
+        # Icon view captions are given as attribute names.
+        if self.icon_settings is not None:
+            self.captions = self.attributes.intersection(self.icon_settings.get_strv("captions"))
+
+    def columns_to_attributes(self, columns):
+        return frozenset(self.attribute_by_column[c] for c in columns if c in self.attribute_by_column)
+
+    def on_settings_changed(self, settings, key):
+        self.load_default()
+        self.directories.clear()
+
+        for dir_uri, directory in self.served.items():
+            directory.reset()
+            self.query(dir_uri)
+
+        self.start_refresh()
+
+    def get_wanted(self, dir_uri):
+        # Never waits for the filesystem: a directory we haven't looked up
+        # yet gets the defaults for now.
+        if dir_uri is None:
+            return self.list_default | self.captions
+
+        entry = self.directories.get(dir_uri)
+
+        if entry is not None:
+            self.directories.move_to_end(dir_uri)
+
+        if entry is None or time.monotonic() - entry[1] >= DIRECTORY_TTL:
+            self.query(dir_uri)
+
+        return entry[0] if entry is not None else self.list_default | self.captions
+
+    def query(self, dir_uri):
+        if dir_uri in self.pending:
+            return
+
+        self.pending.add(dir_uri)
+        Gio.File.new_for_uri(dir_uri).query_info_async(METADATA_KEY, Gio.FileQueryInfoFlags.NONE,
+                                                       GLib.PRIORITY_LOW, None, self.on_query_done, dir_uri)
+
+    def on_query_done(self, location, result, dir_uri):
+        self.pending.discard(dir_uri)
+        columns = self.list_default
+
+        try:
+            stored = location.query_info_finish(result).get_attribute_stringv(METADATA_KEY)
+
+            if stored:
+                columns = self.columns_to_attributes(stored)
+        except GLib.Error:
+            pass
+
+        wanted = columns | self.captions
+        self.directories[dir_uri] = (wanted, time.monotonic())
+        self.directories.move_to_end(dir_uri)
+
+        while len(self.directories) > MAX_LOOKED_UP:
+            self.directories.popitem(last=False)
+
+        directory = self.served.get(dir_uri)
+
+        if directory is None or directory.attributes is None or wanted <= directory.attributes:
+            return
+
+        # More columns than some files were served with.
+        for file in directory.take_missing(wanted):
+            file.invalidate_extension_info()
+
+        directory.reset()
+
+        if not directory.files:
+            del self.served[dir_uri]
+
+    def note_served(self, dir_uri, file, attributes):
+        # Remember files that didn't get all of our attributes, so they can be
+        # filled in if more columns are shown later.
+        if attributes >= self.attributes:
+            directory = self.served.get(dir_uri)
+            if directory is not None:
+                directory.remove(file.get_uri())
+            return
+
+        directory = self.served.pop(dir_uri, None)
+
+        if directory is None:
+            directory = ServedDirectory()
+
+        self.served[dir_uri] = directory
+        directory.add(file, attributes)
+        directory.reset()
+
+        while len(self.served) > MAX_DIRECTORIES:
+            self.served.popitem(last=False)
+
+        self.start_refresh()
+
+    def start_refresh(self):
+        if self.refresh_id == 0 and self.served:
+            self.refresh_id = GLib.timeout_add_seconds(int(DIRECTORY_TTL), self.on_refresh_timeout)
+
+    def on_refresh_timeout(self):
+        # Only looks at the directories that are due - their files are only
+        # walked if their columns changed.
+        now = time.monotonic()
+
+        for dir_uri, directory in list(self.served.items()):
+            if now < directory.next_check:
+                continue
+
+            directory.checks_left -= 1
+
+            if directory.checks_left < 0 or not directory.files:
+                del self.served[dir_uri]
+                continue
+
+            directory.interval *= 2
+            directory.next_check = now + directory.interval
+            self.query(dir_uri)
+
+        if self.served:
+            return True
+
+        self.refresh_id = 0
+        return False
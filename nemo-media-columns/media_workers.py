@@ -0,0 +1,571 @@
+#!/usr/bin/python3
+
+# Background extraction for nemo-media-columns.
+#
+# Nemo calls us on its main loop, so anything that touches the disk is handed
+# to a small pool of worker threads.  Only the completion callback runs back
+# on the main loop, through GLib.idle_add.
+#
+# The parsing itself happens in helper processes (see media_extractors.py),
+# one per worker thread, so a file that hangs a parsing library can be dealt
+# with by killing its process and starting a new one.
+
+import os
+import sys
+import json
+import time
+import heapq
+import queue
+import select
+import threading
+import traceback
+import subprocess
+
+from gi.repository import GLib
+
+DEFAULT_SIZE = 4
+
+# Run as a script, so the parsing libraries are never loaded into Nemo.
+EXTRACTOR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_extractors.py")
+
+# We may be embedded in Nemo, in which case sys.executable isn't a python.
+if os.path.basename(sys.executable).startswith("python"):
+    PYTHON = sys.executable
+else:
+    PYTHON = "/usr/bin/python3"
+
+# Starting a process, and loading the parsing libraries in it, isn't part of
+# any file's time budget.  Each of them gets this long instead.
+STARTUP_TIMEOUT = 15.0
+
+# Requests that have been waiting longer than this (seconds) are no longer
+# likely to be on screen, and may only occupy some of the workers.
+STALE_AGE = 5.0
+
+# How often a running extraction checks whether it's still wanted (seconds).
+CANCEL_POLL = 0.02
+
+# How long a job deferred without a delay waits to be tried again, in case
+# its key is never woken (seconds).
+DEFER_RETRY = 1.0
+
+class ExtractionError(Exception):
+    # Bytes the extractor read before it failed, if known, and how long the
+    # request ran (seconds).
+    bytes_read = None
+    seconds = None
+
+# The process can't be used any more after either of these.
+class ExtractorCrashed(ExtractionError):
+    pass
+
+class ExtractionTimeout(ExtractorCrashed):
+    pass
+
+class ExtractionCancelled(ExtractorCrashed):
+    pass
+
+# The extractor process couldn't be started, couldn't load its parsing
+# libraries, or went away before it was sent the file.  Says nothing about
+# the file, which should be tried again later rather than remembered as a
+# failure.
+class ExtractorUnavailable(ExtractionError):
+    pass
+
+# An idle process that died before it was sent the file.
+class ExtractorGone(ExtractorUnavailable):
+    pass
+
+class JobDeferred(Exception):
+    # Raised by a job that can't start yet, to free its worker.  The job goes
+    # back in the queue, behind the others waiting on the same key (a
+    # mount), until delay seconds have passed or the key is woken.
+    def __init__(self, key, delay=None):
+        Exception.__init__(self, key)
+        self.key = key
+        self.delay = delay
+
+class CancellationToken():
+    # Shared between the main loop, which cancels, and the worker thread
+    # running the job, which checks it while it waits on an extractor.
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+class Job():
+    # The work for one key (a file), shared by every request for that key.
+    def __init__(self, key, func, args):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.token = CancellationToken()
+        self.requests = []
+        self.sequence = 0
+        self.submitted = 0
+        self.stale = False
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+
+class Request():
+    # One caller waiting for a job.  The job itself is only cancelled once
+    # nobody is waiting for it any more.
+    def __init__(self, pool, job, callback, callback_args):
+        self.pool = pool
+        self.job = job
+        self.callback = callback
+        self.callback_args = callback_args
+
+    def cancel(self):
+        self.pool._cancel_request(self)
+
+class ExtractorProcess():
+    def __init__(self):
+        # Raises ExtractorUnavailable if the process doesn't start.
+        try:
+            self.proc = subprocess.Popen([PYTHON, EXTRACTOR_SCRIPT],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         close_fds=True, start_new_session=True)
+        except OSError as e:
+            raise ExtractorUnavailable("could not start the extractor process: %s" % e)
+
+        self.buffer = b""
+        # How long the last request spent loading parsing libraries.
+        self.load_time = 0.0
+
+        started = time.monotonic()
+
+        try:
+            self._read_line(started + STARTUP_TIMEOUT)
+        except ExtractionTimeout:
+            self.kill()
+            raise ExtractorUnavailable("extractor process didn't start within %g second(s)" % STARTUP_TIMEOUT)
+        except ExtractorCrashed as e:
+            self.kill()
+            raise ExtractorUnavailable("extractor process didn't start: %s" % e)
+
+        self.startup_time = time.monotonic() - started
+
+        print("nemo-media-columns: started extractor process %d in %.0f ms" % (self.proc.pid, self.startup_time * 1000))
+
+    def _read_line(self, deadline, token=None):
+        fd = self.proc.stdout.fileno()
+
+        while b"\n" not in self.buffer:
+            if token is not None and token.cancelled:
+                raise ExtractionCancelled()
+
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                raise ExtractionTimeout()
+
+            readable, _, _ = select.select([fd], [], [], min(remaining, CANCEL_POLL))
+
+            if not readable:
+                continue
+
+            chunk = os.read(fd, 65536)
+
+            if not chunk:
+                # Its output closes just before it exits.
+                try:
+                    status = self.proc.wait(1)
+                except subprocess.TimeoutExpired:
+                    status = None
+
+                raise ExtractorCrashed("extractor process exited with status %s" % status)
+
+            self.buffer += chunk
+
+        line, self.buffer = self.buffer.split(b"\n", 1)
+
+        return line
+
+    def extract(self, path, mimetype, attributes, timeout, token=None):
+        # Returns a dict of FileExtensionInfo attributes, only the given
+        # attributes are extracted.
+        request = json.dumps({"path": path, "mimetype": mimetype, "attributes": sorted(attributes)}) + "\n"
+
+        try:
+            self.proc.stdin.write(request.encode())
+            self.proc.stdin.flush()
+        except OSError as e:
+            raise ExtractorGone("extractor process went away: %s" % e)
+
+        started = time.monotonic()
+        deadline = started + timeout
+        self.load_time = 0.0
+        loading = None
+
+        while True:
+            try:
+                reply = json.loads(self._read_line(deadline, token))
+            except ValueError as e:
+                raise ExtractorCrashed("garbled reply from extractor process: %s" % e)
+            except ExtractionCancelled:
+                raise
+            except ExtractionTimeout:
+                if loading is not None:
+                    raise ExtractorUnavailable("extractor process didn't load its libraries within %g second(s)"
+                                               % STARTUP_TIMEOUT)
+                raise
+            except ExtractorCrashed as e:
+                if loading is not None:
+                    raise ExtractorUnavailable("extractor process failed loading its libraries: %s" % e)
+                raise
+
+            if "progress" not in reply:
+                break
+
+            # The file gets what was left of its timeout once the libraries
+            # are loaded.
+            now = time.monotonic()
+
+            if reply["progress"] == "loading":
+                loading = now
+                remaining = deadline - now
+                deadline = now + STARTUP_TIMEOUT
+            else:
+                self.load_time += now - loading
+                loading = None
+                deadline = now + remaining
+
+        if "error" in reply:
+            raise ExtractionError(reply["error"])
+
+        return reply["info"]
+
+    def get_bytes_read(self):
+        # Everything the process has read so far, or None if we can't tell.
+        # rchar rather than read_bytes, which misses network filesystems -
+        # it does include the odd library being imported on first use.
+        try:
+            with open("/proc/%d/io" % self.proc.pid) as f:
+                for line in f:
+                    if line.startswith("rchar:"):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+
+        return None
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except OSError:
+            pass
+
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+class ExtractorPool():
+    # Hands out extractor processes to worker threads, starting new ones as
+    # needed and replacing any that had to be killed.
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.idle = queue.LifoQueue()
+
+    def resize(self, size):
+        self.size = max(1, size)
+
+        while self.idle.qsize() > self.size:
+            try:
+                self.idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+    def extract(self, path, mimetype, attributes, timeout, token=None):
+        # Returns the extracted attributes, how many bytes the extractor read
+        # for them (None if that's unknown) and how long the request took
+        # (seconds) - starting a new process isn't part of that.  Raises
+        # ExtractorUnavailable if no process could be had.
+        if token is not None and token.cancelled:
+            raise ExtractionCancelled()
+
+        try:
+            process = self.idle.get_nowait()
+        except queue.Empty:
+            process = ExtractorProcess()
+
+        before = process.get_bytes_read()
+        started = time.monotonic()
+
+        try:
+            try:
+                info = process.extract(path, mimetype, attributes, timeout, token)
+            except ExtractorGone:
+                # An idle process that died meanwhile - one new one gets a go.
+                process.kill()
+                process = ExtractorProcess()
+                before = process.get_bytes_read()
+                started = time.monotonic()
+                info = process.extract(path, mimetype, attributes, timeout, token)
+        except ExtractionError as e:
+            e.seconds = time.monotonic() - started - process.load_time
+            e.bytes_read = self._bytes_read_since(process, before)
+
+            if isinstance(e, (ExtractorCrashed, ExtractorUnavailable)):
+                process.kill()
+            else:
+                self._release(process)
+            raise
+
+        seconds = time.monotonic() - started - process.load_time
+        bytes_read = self._bytes_read_since(process, before)
+        self._release(process)
+
+        return info, bytes_read, seconds
+
+    def _bytes_read_since(self, process, before):
+        after = process.get_bytes_read()
+
+        if before is None or after is None:
+            return None
+
+        return after - before
+
+    def _release(self, process):
+        if self.idle.qsize() < self.size:
+            self.idle.put(process)
+        else:
+            process.kill()
+
+class RequestScheduler():
+    # Nemo asks for every file of a directory in listing order, long before
+    # most of them are visible.  The most recent request is the one most
+    # likely to be on screen, so pending jobs are handed out newest first.
+    # Once the newest pending job is older than STALE_AGE, everything left is
+    # backlog, which is only allowed to keep part of the workers busy so that
+    # fresh requests still find a free one.
+    #
+    # Deferred jobs wait by key, outside the queue, and are let back in one at
+    # a time - newest first - whenever their key is woken or its delay is up.
+    def __init__(self, size):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.deferred = {}
+        self.ready_at = {}
+        self.sequence = 0
+        self.exits = 0
+        self.stale_running = 0
+        self.stale_limit = max(1, size // 2)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def resize(self, size):
+        with self.condition:
+            self.stale_limit = max(1, size // 2)
+            self.condition.notify_all()
+
+    def push(self, job):
+        with self.condition:
+            self.sequence += 1
+            job.sequence = self.sequence
+            job.submitted = time.monotonic()
+            heapq.heappush(self.heap, (-job.sequence, job))
+            self.condition.notify()
+
+    def push_exit(self):
+        # Makes one worker's next pop() return None.
+        with self.condition:
+            self.exits += 1
+            self.condition.notify()
+
+    def defer(self, job, key, delay=None):
+        with self.condition:
+            ready_at = time.monotonic() + (DEFER_RETRY if delay is None else delay)
+
+            self.deferred.setdefault(key, []).append(job)
+            self.ready_at[key] = min(self.ready_at.get(key, ready_at), ready_at)
+            self.condition.notify()
+
+    def wake(self, key=None, delay=0):
+        # Lets the next job deferred on key (or on every key) back in, after
+        # delay seconds.
+        with self.condition:
+            ready_at = time.monotonic() + delay
+
+            for waiting in (self.ready_at if key is None else (key,)):
+                if waiting in self.ready_at:
+                    self.ready_at[waiting] = ready_at
+
+            self.condition.notify_all()
+
+    def _requeue(self, now):
+        # Returns how long until the next deferred job is due, or None.
+        next_due = None
+
+        for key in list(self.ready_at):
+            jobs = [job for job in self.deferred[key] if not job.cancelled]
+
+            if jobs and self.ready_at[key] <= now:
+                job = max(jobs, key=lambda job: job.sequence)
+                jobs.remove(job)
+                heapq.heappush(self.heap, (-job.sequence, job))
+
+            if jobs:
+                self.deferred[key] = jobs
+
+                # The rest wait for the one let in to finish, or to be
+                # deferred again.
+                if self.ready_at[key] <= now:
+                    self.ready_at[key] = now + DEFER_RETRY
+
+                due = self.ready_at[key] - now
+                next_due = due if next_due is None else min(next_due, due)
+            else:
+                del self.deferred[key]
+                del self.ready_at[key]
+
+        return next_due
+
+    def pop(self):
+        with self.condition:
+            while True:
+                if self.exits > 0:
+                    self.exits -= 1
+                    return None
+
+                next_due = self._requeue(time.monotonic())
+
+                while self.heap and self.heap[0][1].cancelled:
+                    heapq.heappop(self.heap)
+
+                if not self.heap:
+                    self.condition.wait(next_due)
+                    continue
+
+                job = self.heap[0][1]
+                age = time.monotonic() - job.submitted
+
+                if age < STALE_AGE:
+                    heapq.heappop(self.heap)
+                    return job
+
+                if self.stale_running < self.stale_limit:
+                    heapq.heappop(self.heap)
+                    job.stale = True
+                    self.stale_running += 1
+                    return job
+
+                self.condition.wait(next_due)
+
+    def done(self, job):
+        if job.stale:
+            with self.condition:
+                self.stale_running -= 1
+                self.condition.notify()
+
+class WorkerPool():
+    def __init__(self, size=DEFAULT_SIZE):
+        self.scheduler = RequestScheduler(size)
+        self.lock = threading.Lock()
+        self.size = 0
+        self.threads = []
+
+        # Pending and running jobs by key, so concurrent requests for the same
+        # file share one job.  Only touched from the main loop.
+        self.jobs = {}
+
+        self.resize(size)
+
+    def resize(self, size):
+        size = max(1, size)
+
+        with self.lock:
+            while self.size < size:
+                thread = threading.Thread(target=self._run, name="nemo-media-columns-worker", daemon=True)
+                self.threads.append(thread)
+                self.size += 1
+                thread.start()
+
+            # Surplus workers exit once they pick up a sentinel.
+            while self.size > size:
+                self.scheduler.push_exit()
+                self.size -= 1
+
+        self.scheduler.resize(size)
+
+    def submit(self, key, func, args, callback, callback_args=()):
+        # func(*args, token) runs in a worker thread, then callback(result, *callback_args)
+        # is invoked on the main loop, unless the returned request was cancelled
+        # meanwhile.  func should give up early once token.cancelled is set.
+        job = self.jobs.get(key)
+
+        if job is None:
+            job = Job(key, func, args)
+            self.jobs[key] = job
+            self.scheduler.push(job)
+
+        request = Request(self, job, callback, callback_args)
+        job.requests.append(request)
+
+        return request
+
+    def wake(self, key=None, delay=0):
+        # Any thread.  Lets jobs that raised JobDeferred(key) run again.
+        self.scheduler.wake(key, delay)
+
+    def _cancel_request(self, request):
+        job = request.job
+
+        try:
+            job.requests.remove(request)
+        except ValueError:
+            return
+
+        if not job.requests:
+            job.token.cancel()
+
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+
+    def _run(self):
+        while True:
+            job = self.scheduler.pop()
+
+            if job is None:
+                break
+
+            try:
+                result = job.func(*job.args, job.token)
+            except JobDeferred as e:
+                self.scheduler.done(job)
+                self.scheduler.defer(job, e.key, e.delay)
+                continue
+            except ExtractionCancelled:
+                result = None
+            except Exception:
+                traceback.print_exc()
+                result = None
+
+            self.scheduler.done(job)
+            GLib.idle_add(self._complete, job, result)
+
+        with self.lock:
+            self.threads.remove(threading.current_thread())
+
+    def _complete(self, job, result):
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+
+        if not job.cancelled:
+            for request in job.requests:
+                request.callback(result, *request.callback_args)
+
+        job.requests = []
+
+        return False
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+# Metadata stored with the files themselves, in an extended attribute.
+#
+# With use-xattrs on, extracted values are also written to a user.nemo.media
+# xattr on the file, tagged with the file's size and mtime, and read back
+# before any extractor runs.  On a volume shared by several machines (NFS
+# 4.2, or ext4/XFS that's moved around) a file parsed on one of them is then
+# known to all the others, without a central database.
+#
+# The value is compact JSON:
+#
+#   {"size":12345,"mtime_ns":1700000000123456789,"computed":"title length",
+#    "fields":{"title":"...","length":215.3}}
+#
+# computed lists the attributes that were extracted, as in the cache, and
+# fields holds the values of those that were found.  The name carries a
+# version, to be bumped if that ever changes incompatibly.
+#
+# Files we can't write to (read-only mounts, someone else's files) or whose
+# filesystem has no user xattrs are left alone - the local cache still has
+# their values.
+
+import os
+import json
+import errno
+
+import media_info
+
+XATTR_NAME = "user.nemo.media.v1"
+
+# ext4 keeps all of a file's xattrs in a single block, which they share with
+# ACLs, SELinux labels and so on.
+MAX_SIZE = 2048
+
+# Errors that just mean there's no usable xattr here.
+IGNORED_ERRORS = (errno.ENODATA, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EACCES, errno.EPERM,
+                  errno.EROFS, errno.E2BIG, errno.ERANGE, errno.ENOSPC, errno.EDQUOT)
+
+def is_supported():
+    return hasattr(os, "getxattr")
+
+def read(path, stat):
+    # Returns a dict of FileExtensionInfo fields and the set of attributes
+    # that were extracted, like MetadataCache.lookup(), or None if the file
+    # has no xattr for this version of it.
+    try:
+        value = os.getxattr(path, XATTR_NAME)
+    except OSError as e:
+        if e.errno not in IGNORED_ERRORS:
+            print("nemo-media-columns: could not read the metadata stored on '%s': %s" % (path, e))
+        return None
+
+    try:
+        stored = json.loads(value)
+
+        if stored["size"] != stat.st_size or stored["mtime_ns"] != stat.st_mtime_ns:
+            return None
+
+        computed = frozenset(stored["computed"].split()).intersection(media_info.ATTRIBUTES)
+        fields = dict.fromkeys(media_info.FIELDS)
+
+        for field in media_info.get_fields(computed):
+            value = stored["fields"].get(field)
+
+            if field in media_info.TEXT_FIELDS:
+                fields[field] = value if isinstance(value, str) else None
+            else:
+                fields[field] = value if isinstance(value, (int, float)) else None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        # Not ours, or written by something broken - it will be replaced.
+        return None
+
+    return fields, computed
+
+def merge(cached, stored):
+    # Adds what read() found to a cache entry (or None), the stored values
+    # taking precedence.
+    if cached is None:
+        return stored
+
+    fields = dict(cached[0])
+
+    for field in media_info.get_fields(stored[1]):
+        fields[field] = stored[0][field]
+
+    return fields, cached[1] | stored[1]
+
+def write(path, stat, info, computed):
+    fields = dict((field, getattr(info, field)) for field in media_info.get_fields(computed)
+                  if getattr(info, field) is not None)
+    value = json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                        "computed": " ".join(sorted(computed)), "fields": fields},
+                       ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    if len(value) > MAX_SIZE:
+        return False
+
+    try:
+        os.setxattr(path, XATTR_NAME, value)
+    except OSError as e:
+        if e.errno not in IGNORED_ERRORS:
+            print("nemo-media-columns: could not store the metadata on '%s': %s" % (path, e))
+        return False
+
+    return True
@@ -23,22 +23,31 @@
 # Julien Blanc: fix bug caused by missing Exif.Image.Software key
 # mtwebster: convert for use as a nemo extension
 import os
-import stopit
+import sys
+import time
+import sqlite3
 import locale
 import gettext
+import threading
 from urllib import parse
-import gi
-gi.require_version('GExiv2', '0.10')
-from gi.repository import Nemo, GObject, Gtk, GdkPixbuf, GExiv2, GLib, Gio
-# for id3 support
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
-# for reading videos. for future improvement, this can also read mp3!
-from pymediainfo import MediaInfo
-# for reading image dimensions
-import PIL.Image
-# for reading pdf
-from pypdf import PdfReader
+from collections import OrderedDict
+from gi.repository import Nemo, GObject, Gio
+
+sys.path.append("/usr/share/nemo-media-columns")
+
+import media_cache
+import media_extractors
+import media_visibility
+import media_workers
+import media_info
+import media_monitor
+import media_mounts
+import media_source
+import media_stats
+import media_thumbnails
+import media_timeouts
+import media_xattrs
+from media_info import FileExtensionInfo
 
 # Import the gettext function and alias it as _
 from gettext import gettext as _
@@ -54,32 +63,60 @@ gettext.bindtextdomain(APP, LOCALE_DIR)
 gettext.textdomain(APP)
 _ = gettext.gettext
 
-class FileExtensionInfo():
-    def __init__(self):
-        self.title = None
-        self.album = None
-        self.artist = None
-        self.tracknumber = None
-        self.genre = None
-        self.date = None
-        self.bitrate = None
-        self.pages = None
-        self.samplerate = None
-        self.length = None
-        self.composer = None
-        self.description = None
-        self.exif_datetime_original = None
-        self.exif_software = None
-        self.exif_flash = None
-        self.exif_pixeldimensions = None
-        self.exif_rating = None
-        self.pixeldimensions = None
+# Locations that never hold media files of their own.
+VIRTUAL_SCHEMES = ('computer', 'network', 'x-nemo-desktop', 'burn')
+
+# How many times in a row a file may time out before it's given up on, like
+# a file that can't be parsed.  A timeout can just be a busy disk or a slow
+# server.
+MAX_TIMEOUTS = 3
+
+# How many failed and timed out files are remembered here, most recently
+# seen first.  Older failures are still found in the cache.
+MAX_FAILURES = 4096
 
+def remember(entries, filename, value):
+    # Adds to ColumnExtension.failures or timed_out, dropping the least
+    # recently seen files past MAX_FAILURES.
+    entries[filename] = value
+    entries.move_to_end(filename)
 
+    while len(entries) > MAX_FAILURES:
+        entries.popitem(last=False)
 
 class ColumnExtension(GObject.GObject, Nemo.ColumnProvider, Nemo.InfoProvider, Nemo.NameAndDescProvider):
     def __init__(self):
         self.ids_by_handle = {}
+        self.cache = None
+        self.workers = media_workers.WorkerPool()
+        self.extractors = media_workers.ExtractorPool()
+
+        # Files that couldn't be processed, by path, with the (size, mtime)
+        # they had at the time - they're not retried until they change.  Also
+        # kept in the cache, which survives restarts and has the details.
+        self.failures = OrderedDict()
+        self.failures_lock = threading.Lock()
+
+        # Files that timed out, by path, with the (size, mtime) they had and
+        # how many times in a row - only kept here, until MAX_TIMEOUTS.
+        self.timed_out = OrderedDict()
+
+        # Drops what we know about files in the directories we've filled in
+        # as soon as they change.
+        self.monitors = media_monitor.DirectoryMonitors(self.on_file_changed)
+
+        # Network and FUSE mounts get their own, lower, limits.
+        self.mounts = media_mounts.MountTable()
+        self.remote_limits = media_mounts.MountLimiter(wake=self.workers.wake)
+
+        # Written to a file only if write-stats is on.
+        self.stats = media_stats.RuntimeStats()
+
+        # How long each kind of file gets, if adaptive-timeout is on.
+        self.timeouts = media_timeouts.AdaptiveTimeouts()
+
+        self.visible_columns = media_visibility.VisibleColumns(dict((column.get_property("name"), column.get_property("attribute"))
+                                                                    for column in self.get_columns()))
 
         self.settings = Gio.Settings(schema_id="org.nemo.extensions.nemo-media-columns")
         self.load_settings(self.settings)
@@ -91,8 +128,49 @@ class ColumnExtension(GObject.GObject, Nemo.ColumnProvider, Nemo.InfoProvider, N
         # I don't think we should ever allow it to run forever, regardless
         # of preference.
         self.timeout = self.settings.get_double("timeout") if use_timeout else 30.0
+        adaptive = use_timeout and self.settings.get_boolean("adaptive-timeout")
+
+        self.timeouts.configure(self.timeout, adaptive)
+
+        if adaptive:
+            print("nemo-media-columns: using timeouts learned for each file type, of up to %.2f second(s)"
+                  % self.timeout)
+        else:
+            print("nemo-media-columns: using a timeout of %.2f second(s) for file processing" % self.timeout)
 
-        print("nemo-media-columns: using a timeout of %.2f second(s) for file processing" % self.timeout)
+        self.workers.resize(self.settings.get_int("workers"))
+        self.extractors.resize(self.settings.get_int("workers"))
+
+        self.remote_limits.configure(self.settings.get_int("remote-workers"),
+                                     self.settings.get_int("remote-read-rate") * 1024)
+        self.remote_cache_only = self.settings.get_boolean("remote-cache-only")
+
+        self.use_xattrs = self.settings.get_boolean("use-xattrs") and media_xattrs.is_supported()
+
+        self.stats.enable(media_stats.get_stats_path() if self.settings.get_boolean("write-stats") else None)
+
+        self.load_cache()
+
+    def load_cache(self):
+        use_cache = self.settings.get_boolean("use-cache")
+        cache_size = self.settings.get_int("cache-size")
+
+        if not use_cache:
+            if self.cache is not None:
+                self.cache.close()
+                self.cache = None
+            return
+
+        if self.cache is not None:
+            if self.cache.max_entries != cache_size:
+                self.cache.set_max_entries(cache_size)
+            return
+
+        try:
+            self.cache = media_cache.MetadataCache(max_entries=cache_size)
+        except (OSError, sqlite3.Error) as e:
+            print("nemo-media-columns: could not open the metadata cache at '%s': %s" % (media_cache.DEFAULT_PATH, e))
+            self.cache = None
 
     def get_columns(self):
         locale.bindtextdomain(APP, LOCALE_DIR)
@@ -122,11 +200,9 @@ class ColumnExtension(GObject.GObject, Nemo.ColumnProvider, Nemo.InfoProvider, N
         )
 
     def set_file_attributes(self, file, info):
-        for attribute in ("title", "album", "artist", "tracknumber",
-                          "genre", "date", "bitrate", "pages", "samplerate",
-                          "length", 'composer', 'description', "exif_datetime_original", "exif_software",
-                          "exif_flash", "exif_pixeldimensions", "exif_rating", "pixeldimensions"):
-            value = getattr(info, attribute)
+        # The only place values are turned into text.
+        for attribute in media_info.ATTRIBUTES:
+            value = media_info.format_attribute(info, attribute)
             if value is None:
                 file.add_string_attribute(attribute, '')
             else:
@@ -134,248 +210,290 @@ class ColumnExtension(GObject.GObject, Nemo.ColumnProvider, Nemo.InfoProvider, N
 
     def cancel_update(self, provider, handle):
         if handle in self.ids_by_handle.keys():
-            GObject.source_remove(self.ids_by_handle[handle])
+            self.ids_by_handle[handle].cancel()
             del self.ids_by_handle[handle]
 
     def update_file_info_full(self, provider, handle, closure, file):
-        if file.get_uri_scheme() not in ('file', 'recent', 'favorites'):
+        # Files that aren't local (sftp, smb, mtp... through gvfs) are read as
+        # GIO streams.
+        if file.get_uri_scheme() in VIRTUAL_SCHEMES:
             return Nemo.OperationResult.COMPLETE
 
         if handle in self.ids_by_handle.keys():
-            GObject.source_remove(self.ids_by_handle[handle])
+            self.ids_by_handle[handle].cancel()
+            del self.ids_by_handle[handle]
 
-        self.ids_by_handle[handle] = GObject.idle_add(self.update_cb, provider, handle, closure, file)
+        # NemoFileInfo is not thread-safe, so gather everything the worker needs here.
+        mimetype = file.get_mime_type()
+        extractor = media_extractors.registry.lookup(mimetype)
 
-        return Nemo.OperationResult.IN_PROGRESS
+        # Not one of ours (directories included) - leave the file alone rather
+        # than setting every column to ''.
+        if extractor is None:
+            return Nemo.OperationResult.COMPLETE
 
-    def update_cb(self, provider, handle, closure, file):
-        # stopit uses threads, so don't give it anything that isn't safe
+        # Only extract what the view this file is shown in displays.
+        dir_uri = file.get_parent_uri()
+        visible = self.visible_columns.get_wanted(dir_uri)
+        wanted = visible.intersection(extractor.attributes)
+        # What the file is complete for - columns the extractor can't fill in
+        # don't need to be asked for again.
+        served = visible | self.visible_columns.attributes.difference(extractor.attributes)
+
+        if not wanted:
+            # Come back to it if one of its columns is shown later.
+            self.visible_columns.note_served(dir_uri, file, served)
+            return Nemo.OperationResult.COMPLETE
 
-        mimetype = file.get_mime_type()
         # Recent and Favorites set the G_FILE_ATTRIBUTE_STANDARD_TARGET_URI attribute
         # to their real files' locations. Use that uri in those cases.
         uri = file.get_activation_uri()
-        info = None
 
-        if uri.startswith("file"):
-            try:
-                with stopit.ThreadingTimeout(self.timeout):
-                    info = self.get_media_info(uri, mimetype)
-            except stopit.utils.TimeoutException:
-                print("nemo-media-columns failed to process '%s' within a reasonable amount of time" % (gfile.get_uri(), e))
-
-        # TODO: we shouldn't set attributes on files that didn't match any of our mimetypes.
-        # we do currently so the given columns can be set to '' - we should maybe do this in
-        # nemo (https://github.com/linuxmint/nemo/blob/master/libnemo-private/nemo-file.c#L6811-L6814)
-        # so that here we only set files that we support.
-        #
-        # get_media_info can return None if nothing matched, or there was an error, instead of always
-        # adding the attributes to a file whether it's useful or not.
+        # Requests for the same file from several handles share one job.
+        self.ids_by_handle[handle] = self.workers.submit((uri, wanted), self.get_file_media_info, (uri, mimetype, wanted),
+                                                         self.update_cb, (provider, handle, closure, file, uri, dir_uri, served))
+        self.stats.record_queue_depth(len(self.workers.jobs))
+
+        return Nemo.OperationResult.IN_PROGRESS
+
+    def get_file_media_info(self, uri, mimetype, wanted, token):
+        # Runs in a worker thread.
+        if wanted and not token.cancelled:
+            return self.get_cached_media_info(uri, mimetype, wanted, token)
 
+        return None
+
+    def update_cb(self, info, provider, handle, closure, file, uri, dir_uri, served):
+        # Back on the main loop.  Files we don't handle never get here, so
+        # this is one of ours - if there was an error its columns are set to ''.
         if info == None:
             info = FileExtensionInfo()
 
         # if info:
         self.set_file_attributes(file, info)
-        del info
+
+        self.visible_columns.note_served(dir_uri, file, served)
+
+        # The real directory, for Recent and Favorites.
+        if uri.startswith("file:"):
+            self.monitors.watch(Gio.File.new_for_uri(uri).get_parent())
 
         if handle in self.ids_by_handle.keys():
             del self.ids_by_handle[handle]
 
         Nemo.info_provider_update_complete_invoke(closure, provider, handle, Nemo.OperationResult.COMPLETE)
 
-        return False
-
-    def get_media_info(self, uri, mimetype):
-        # strip file:// to get absolute path
-        filename = parse.unquote(uri[7:])
-
-        def file_is_one_of_these(mimetype_list):
-            for t in mimetype_list:
-                if Gio.content_type_is_a(mimetype, t):
-                    return True
-
-        # mp3 handling
-        if file_is_one_of_these(('audio/mpeg',)):
-            info = FileExtensionInfo()
-            # attempt to read ID3 tag
-            id3_good = True
-            mp3_good = True
-
-            try:
-                audio = EasyID3(filename)
-
-                # sometimes the audio variable will not have one of these items defined, that's why
-                # there is this long try / except attempt
-                try: info.title = audio["title"][0]
-                except: pass
-                try: info.album = audio["album"][0]
-                except: pass
-                try: info.artist = audio["artist"][0]
-                except: pass
-                try: info.tracknumber = "{:0>2}".format(audio["tracknumber"][0])
-                except: pass
-                try: info.genre = audio["genre"][0]
-                except: pass
-                try: info.date = audio["date"][0]
-                except: pass
-                try: info.composer = audio["composer"][0]
-                except: pass
-                try: info.description = audio["version"][0]
-                except: pass
-            except Exception as e:
-                id3_good = False
-
-            # try to read MP3 information (bitrate, length, samplerate)
-            try:
-                with open(filename, 'rb') as mpfile:
-                    mpinfo = MP3(mpfile).info
-                    info.bitrate = str(mpinfo.bitrate / 1000) + " Kbps"
-                    info.samplerate = str(mpinfo.sample_rate) + " Hz"
-                    # [SabreWolfy] added consistent formatting of times in format hh:mm:ss
-                    # [SabreWolfy[ to allow for correct column sorting by length
-                    info.length = "%02i:%02i:%02i" % ((int(mpinfo.length/3600)), (int(mpinfo.length/60%60)), (int(mpinfo.length%60)))
-            except Exception:
-                mp3_good = False
-
-            return info # if (id3_good or mp3_good) else None
-        # image handling
-        elif file_is_one_of_these(('image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff')):
-            info = FileExtensionInfo()
-            # EXIF handling routines
-            exiv_good = True
-            pil_good = True
-            try:
-                metadata = GExiv2.Metadata(path=filename)
-
-                try:
-                    info.exif_datetime_original = str(metadata.get_date_time())
-                except:
-                    pass
-
-                info.exif_software = metadata.get('Exif.Image.Software', None)
-                info.exif_flash = metadata.get('Exif.Photo.Flash', None)
-                info.exif_rating = metadata.get('Xmp.xmp.Rating', None)
-            except GLib.Error as e:
-                exif = False
-
-            # try read image info directly
-            try:
-                im = PIL.Image.open(filename)
-                info.pixeldimensions = str(im.size[0])+'x'+str(im.size[1])
-            except Exception as e:
-                pil_good = False
-
-            return info # if (exiv_good or pil_good) else None
-        # video/flac handling
-        elif file_is_one_of_these(('video/x-msvideo', 'video/mpeg', 'video/x-ms-wmv', 'video/mp4',
-                                   'audio/x-flac', 'video/x-flv', 'video/x-matroska', 'audio/x-wav',
-                                   'audio/m4a', 'audio/mp4')):
-            info = FileExtensionInfo()
-            mediainfo_good = True
+    def on_file_changed(self, filename):
+        # Main loop, from the directory monitors.  Nemo asks for the file
+        # again if it's still shown, and it's extracted afresh.
+        with self.failures_lock:
+            self.failures.pop(filename, None)
+            self.timed_out.pop(filename, None)
+
+        if self.cache is not None:
+            self.cache.evict(filename)
+
+    def get_cached_media_info(self, uri, mimetype, wanted, token=None):
+        # Files that aren't local are handled by their URI in place of a path.
+        local = uri.startswith("file://")
+
+        if local:
+            filename = parse.unquote(uri[7:])
+            stat_func = os.stat
+        else:
+            filename = uri
+            stat_func = media_source.stat_uri
+
+        # The cache may be swapped out from the main loop while we're working.
+        cache = self.cache
+        cached = None
+        computed = frozenset()
+
+        try:
+            stat = stat_func(filename)
+        except OSError:
+            return None
+
+        if cache is not None:
+            cached = cache.lookup(filename, stat)
+
+        # What this or another machine stored on the file itself.
+        if self.use_xattrs and local and (cached is None or not wanted <= cached[1]):
+            stored = media_xattrs.read(filename, stat)
+
+            if stored is not None and (cached is None or not stored[1] <= cached[1]):
+                self.stats.record_cache("xattrs")
+                cached = media_xattrs.merge(cached, stored)
+
+                if cache is not None:
+                    cache.store(filename, stat, FileExtensionInfo(cached[0]), cached[1], mimetype)
+
+        if cached is not None:
+            fields, computed = cached
+
+            if wanted <= computed:
+                self.stats.record_cache("hits")
+                return FileExtensionInfo(fields)
+
+        # Partial hits and misses are counted once we know the file won't be
+        # deferred, and looked up all over again.
+        lookup = "partial" if cached is not None else "misses" if cache is not None else None
+
+        with self.failures_lock:
+            known_failure = self.failures.get(filename) == (stat.st_size, stat.st_mtime_ns)
+
+            if known_failure:
+                self.failures.move_to_end(filename)
+
+        if not known_failure and cache is not None and cache.lookup_failure(filename, stat) is not None:
+            with self.failures_lock:
+                remember(self.failures, filename, (stat.st_size, stat.st_mtime_ns))
+            known_failure = True
+
+        if known_failure:
+            if lookup is not None:
+                self.stats.record_cache(lookup)
+            self.stats.record_cache("known_failures")
+            return None
+
+        # Only extract what's missing from the cache, and from Nemo's
+        # thumbnail of the file, if it has one.
+        missing = wanted - computed
+        thumbnail = media_thumbnails.lookup(uri, stat, missing) or {}
+        missing -= media_thumbnails.get_attributes(thumbnail)
+
+        if missing:
+            mount = self.mounts.lookup(filename)
+            ticket = None
+
+            if mount.remote:
+                if self.remote_cache_only:
+                    if lookup is not None:
+                        self.stats.record_cache(lookup)
+                    return FileExtensionInfo(fields) if cached is not None else None
+
+                # Frees this worker if the mount is busy, for files elsewhere.
+                ticket = self.remote_limits.acquire(mount, stat.st_size)
+
+            if lookup is not None:
+                self.stats.record_cache(lookup)
+
+            started = time.monotonic()
+            timeout_key = media_timeouts.get_key(media_extractors.registry.lookup(mimetype).name,
+                                                 stat.st_size, mount.remote)
 
             try:
-                mediainfo = MediaInfo.parse(filename)
-
-                duration = 0
-
-                for trackobj in mediainfo.tracks:
-                    track = trackobj.to_data()
-
-                    if track["track_type"] == "Video":
-                        try:
-                            info.pixeldimensions = "%dx%d" % (track["width"], track["height"])
-                        except:
-                            pass
-
-                        try:
-                            duration = int(float(track['duration']))
-                        except:
-                            pass
-
-                    if track["track_type"] == "Audio":
-                        try:
-                            info.samplerate = track['other_sampling_rate'][0]
-                        except:
-                            pass
-                        try:
-                            if duration == 0:
-                                duration = int(track['duration'])
-                        except:
-                            pass
-
-                    if track["track_type"] == "General":
-                        try:
-                            info.bitrate = track['other_overall_bit_rate'][0]
-                        except:
-                            pass
-                        try:
-                            if duration == 0:
-                                duration = int(track['duration'])
-                        except:
-                            pass
-                        try:
-                            info.title = track['track_name']
-                        except:
-                            pass
-                        try:
-                            info.artist = track['performer']
-                        except:
-                            pass
-                        try:
-                            info.genre = track['genre']
-                        except:
-                            pass
-                        try:
-                            info.tracknumber = track['track_name_position']
-                        except:
-                            pass
-                        try:
-                            info.date = track['recorded_date']
-                        except:
-                            pass
-                        try:
-                            info.album = track['album']
-                        except:
-                            pass
-                        try:
-                            info.description = track['description']
-                        except:
-                            pass
-                        try:
-                            info.composer = track['composer']
-                        except:
-                            pass
-
-                if duration > 0:
-                    seconds = duration / 1000 # ms to s
-                    info.length = "%02i:%02i:%02i" % ((seconds / 3600), (seconds / 60 % 60), (seconds % 60))
-            except Exception as e:
-                mediainfo_good = False
-
-            return info #if mediainfo_good else None
-
-        # pdf handling
-        elif file_is_one_of_these(('application/pdf',)):
+                info, error = self.get_media_info(filename, mimetype, missing, token, ticket, timeout_key)
+            except media_workers.ExtractionTimeout as e:
+                self.note_timeout(filename, stat, str(e), time.monotonic() - started)
+                return None
+            except media_workers.ExtractorUnavailable:
+                # Nothing to do with the file - it's tried again when it's
+                # next asked for.
+                return None
+            finally:
+                if ticket is not None:
+                    self.remote_limits.release(ticket)
+
+            with self.failures_lock:
+                self.timed_out.pop(filename, None)
+
+            if info is None:
+                with self.failures_lock:
+                    remember(self.failures, filename, (stat.st_size, stat.st_mtime_ns))
+                if cache is not None:
+                    cache.store_failure(filename, stat, error, time.monotonic() - started)
+                return None
+        else:
+            if lookup is not None:
+                self.stats.record_cache(lookup)
+            self.stats.record_cache("thumbnails")
             info = FileExtensionInfo()
-            pdf_good = True
 
-            try:
-                with open(filename, "rb") as f:
-                    pdf = PdfReader(f)
-                    try: info.title = pdf.metadata.title
-                    except: pass
-                    try: info.artist = pdf.metadata.author
-                    except: pass
-                    try: info.pages = str(len(pdf.pages))
-                    except: pass
-            except:
-                pdf_good = False
-
-            return info # if pdf_good else None
-
-        # return None # TODO - not a file we care about, we shouldn't add attributes to a file in this case.
-        return FileExtensionInfo()
+        for field, value in thumbnail.items():
+            setattr(info, field, value)
+
+        if cached is not None:
+            for field in media_info.get_fields(computed):
+                setattr(info, field, fields[field])
+
+        if cache is not None:
+            cache.store(filename, stat, info, computed | wanted, mimetype)
+
+        if self.use_xattrs and local:
+            media_xattrs.write(filename, stat, info, computed | wanted)
+
+        return info
+
+    def note_timeout(self, filename, stat, error, cost):
+        # Only a file that keeps timing out is remembered as a failure.
+        version = (stat.st_size, stat.st_mtime_ns)
+
+        with self.failures_lock:
+            previous = self.timed_out.get(filename)
+            count = previous[1] + 1 if previous is not None and previous[0] == version else 1
+
+            if count < MAX_TIMEOUTS:
+                remember(self.timed_out, filename, (version, count))
+                return
+
+            del self.timed_out[filename]
+            remember(self.failures, filename, version)
+
+        cache = self.cache
+
+        if cache is not None:
+            cache.store_failure(filename, stat, "%s (%d times in a row)" % (error, count), cost)
+
+    def get_media_info(self, filename, mimetype, wanted, token=None, ticket=None, timeout_key=None):
+        # Runs the parsers in one of our extractor processes, which is killed
+        # if it takes longer than the timeout, or if nobody wants the result
+        # any more.  ExtractionCancelled, ExtractionTimeout and
+        # ExtractorUnavailable are passed on to the caller, as none of them
+        # says anything certain about the file itself.  What
+        # the extractor read is charged to ticket, for files on remote mounts.
+        # The timeout is the one learned for timeout_key, if given.
+        # Returns (info, None), or (None, error message) if the file failed.
+        extractor = media_extractors.registry.lookup(mimetype).name
+        timeout = self.timeout if timeout_key is None else self.timeouts.get(timeout_key)
+
+        # Times are those of the request itself, without starting a process.
+        try:
+            fields, bytes_read, seconds = self.extractors.extract(filename, mimetype, wanted, timeout, token)
+        except media_workers.ExtractorUnavailable as e:
+            # Not the file's doing, so it's neither a failure nor a sample
+            # for the timeouts.
+            print("nemo-media-columns could not process '%s': %s" % (filename, e))
+            raise
+        except media_workers.ExtractionError as e:
+            if ticket is not None:
+                ticket.charge(e.bytes_read)
+
+            seconds = e.seconds or 0.0
+
+            if isinstance(e, media_workers.ExtractionCancelled):
+                self.stats.record_extraction(extractor, mimetype, "cancelled", seconds, e.bytes_read)
+                raise
+            if isinstance(e, media_workers.ExtractionTimeout):
+                self.stats.record_extraction(extractor, mimetype, "timeout", seconds, e.bytes_read)
+                if timeout_key is not None:
+                    self.timeouts.record(timeout_key, timeout)
+                print("nemo-media-columns failed to process '%s' within a reasonable amount of time" % filename)
+                raise media_workers.ExtractionTimeout("timed out after %.2f second(s)" % timeout)
+
+            self.stats.record_extraction(extractor, mimetype, "failed", seconds, e.bytes_read)
+            print("nemo-media-columns failed to process '%s': %s" % (filename, e))
+            return None, str(e)
+
+        self.stats.record_extraction(extractor, mimetype, "done", seconds, bytes_read)
+
+        if timeout_key is not None:
+            self.timeouts.record(timeout_key, seconds)
+
+        if ticket is not None:
+            ticket.charge(bytes_read)
+
+        return FileExtensionInfo(fields), None
 
     def get_name_and_desc(self):
         description = _("Provides additional columns for the list view")
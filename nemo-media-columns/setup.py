@@ -25,11 +25,19 @@ setup( packages=[],
     #                     'mutagen',
     #                     'pypdf',
     #                     'pil',
-    #                     'pymediainfo'
-    #                     'stopit'],
+    #                     'pymediainfo'],
     data_files   = [
         ('/usr/share/nemo-python/extensions', ['nemo-media-columns.py']),
-        ('/usr/bin',                          ['nemo-media-columns-prefs']),
+        ('/usr/share/nemo-media-columns',     ['media_audio.py', 'media_cache.py',
+                                               'media_extractors.py', 'media_image.py',
+                                               'media_info.py', 'media_monitor.py',
+                                               'media_mounts.py', 'media_pdf.py',
+                                               'media_query.py', 'media_source.py',
+                                               'media_stats.py', 'media_thumbnails.py',
+                                               'media_timeouts.py', 'media_visibility.py',
+                                               'media_workers.py', 'media_xattrs.py']),
+        ('/usr/bin',                          ['nemo-media-columns-prefs', 'nemo-media-columns-query',
+                                               'nemo-media-columns-scan']),
         ('/usr/share/glib-2.0/schemas',       ['org.nemo.extensions.nemo-media-columns.gschema.xml'])
     ]
 )